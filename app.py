@@ -4,7 +4,16 @@ import numpy as np
 import dark_channel_prior as dcp
 import inference as inf
 import pandas as pd
+import os
+import tempfile
+import time
 from collections import Counter
+import preprocessing as pre
+from pipeline import Pipeline
+from result_cache import ResultCache, cache_key
+from video_detection import detect_video
+from detection_stats import current_session
+from event_log import get_event_log
 
 # Function to remove noise from an image
 def remove_noise(image):
@@ -14,13 +23,123 @@ def remove_noise(image):
 
 
 # Function to perform object detection on an image
-def detect_objects(image):
+def detect_objects(image, imgsz=pre.INFERENCE_SIZE, sliced=False):
     # Replace this with your object detection code
     # Make sure the output image has bounding boxes around the detected objects
-    output_image, class_names = inf.detect(image)
+    if sliced:
+        result = inf.detect_sliced(image, slice_size=imgsz, plot=True)
+        inf.stats.add(result['class_ids'])
+        return result['image'], result['class_names']
+    output_image, class_names = pre.detect(image, imgsz)
     return output_image, class_names
 
 
+# Results of the single image and batch flows by image content and parameters, shared by every session.
+# Bounded by RESULT_CACHE_MB of images as well as RESULT_CACHE_SIZE entries, a 4K entry holds about 75MB.
+# RESULT_CACHE_DIR adds an on-disk tier that survives restarts.
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(max_items=int(os.environ.get('RESULT_CACHE_SIZE', 32)),
+                       disk_dir=os.environ.get('RESULT_CACHE_DIR'),
+                       max_bytes=int(float(os.environ.get('RESULT_CACHE_MB', 512)) * 2 ** 20))
+
+
+# One dehaze -> detect pipeline per server process, its dehazing pool is reused across reruns
+@st.cache_resource
+def get_pipeline():
+    return Pipeline(batch_size=8, plot=True).start()
+
+
+def batch_app(haze_threshold=None, imgsz=pre.INFERENCE_SIZE, dehaze_size=pre.DEHAZE_SIZE):
+    st.markdown("### 🗂️ Batch Detection")
+    st.info("Upload several images at once. Dehazing and detection run in parallel, so large batches finish much faster than one image at a time.")
+    files = st.file_uploader("Choose image files", type=["jpg", "jpeg", "png"], accept_multiple_files=True,
+                             key="batch_files")
+    # the uploader keeps its files across reruns, so only an explicit click starts the batch
+    if not files or not st.button("Run batch detection"):
+        return
+
+    progress_bar = st.progress(0)
+    result_cache = get_result_cache()
+    keys = [cache_key(file.getvalue(), source='batch', imgsz=imgsz, dehaze_size=dehaze_size,
+                      haze_threshold=haze_threshold, model=inf.model_version(), **pre.DEHAZE_PARAMS)
+            for file in files]
+    results = [result_cache.get(key) for key in keys]
+    todo = [i for i, result in enumerate(results) if result is None]
+    rows = []
+    start = time.perf_counter()
+
+    def show(name, result):
+        rows.append({'Image': name, 'Dehazed': 'yes' if result['dehaze_ran'] else 'no (clear)',
+                     'Objects': len(result['class_names']),
+                     'Waste Types': ', '.join(sorted(set(result['class_names']))) or '-'})
+        with st.expander(f"{name} - {len(result['class_names'])} object(s)"):
+            st.image(result['image'], caption="Detected objects with bounding boxes")
+        progress_bar.progress(len(rows) / len(files))
+
+    # files already in the result cache were counted in inf.stats and the event log when first detected
+    for file, result in zip(files, results):
+        if result is not None:
+            show(file.name, result)
+    pipeline = get_pipeline()
+    for result in pipeline.run([files[i].getvalue() for i in todo], haze_threshold, imgsz, dehaze_size):
+        i = todo[result['index']]
+        name = files[i].name
+        if 'error' in result:
+            st.warning(f"{name}: {result['error']}")
+            continue
+        inf.stats.add(result['class_ids'])
+        get_event_log().record('detection', result['class_names'], session=current_session(),
+                               params={'source': 'batch', 'file': name, 'imgsz': imgsz, 'dehaze_size': dehaze_size,
+                                       'dehazed': result['dehaze_ran']})
+        result = {'image': result['image'], 'class_names': result['class_names'], 'dehaze_ran': result['dehaze_ran']}
+        result_cache.put(keys[i], result)
+        show(name, result)
+    elapsed = time.perf_counter() - start
+
+    progress_bar.empty()
+    st.success(f"Processed {len(rows)} image(s) in {elapsed:.1f}s ({len(files) / elapsed:.2f} images/s), "
+               f"{len(files) - len(todo)} from the result cache")
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+
+def video_app(imgsz=pre.INFERENCE_SIZE, dehaze_size=pre.DEHAZE_SIZE):
+    st.markdown("### 🎥 Video Detection")
+    st.info("Upload a dive video. The detector runs on every Nth frame and follows each item in between, so every piece of waste is counted once.")
+    video = st.file_uploader("Choose a video file", type=["mp4", "avi", "mov", "mkv"], key="video_file")
+    detect_every = st.slider("Run the detector every N frames", 1, 30, 5)
+    dehaze = st.checkbox("Dehaze the detected frames", value=True)
+    low_memory = st.checkbox("Low-memory dehazing", value=True, disabled=not dehaze,
+                             help="Dehazes in float32, within a grey level of float64 and faster on large frames")
+    if video is None or not st.button("Analyse video"):
+        return
+
+    progress_bar = st.progress(0)
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(video.name)[1]) as f:
+        f.write(video.getvalue())
+        f.flush()
+        total = int(cv2.VideoCapture(f.name).get(cv2.CAP_PROP_FRAME_COUNT)) or 1
+        summary = detect_video(f.name, detect_every, dehaze, imgsz=imgsz, dehaze_size=dehaze_size,
+                               low_memory=low_memory,
+                               progress=lambda done: progress_bar.progress(min(done / total, 1.0)))
+    progress_bar.empty()
+
+    # one entry per unique item, unlike per-frame detections
+    inf.stats.add([inf.labels.index(name) for name in summary['counts'].elements()])
+    get_event_log().record('detection', summary['counts'].elements(), result=dict(summary['counts']),
+                           session=current_session(),
+                           params={'source': 'video', 'file': video.name, 'detect_every': detect_every,
+                                   'frames': summary['frames'], 'imgsz': imgsz,
+                                   'dehaze_size': dehaze_size if dehaze else None})
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Unique items", sum(summary['counts'].values()))
+    col2.metric("Frames", f"{summary['frames']} ({summary['detected_frames']} detected)")
+    col3.metric("Effective FPS", f"{summary['fps']:.1f}")
+    if summary['counts']:
+        counts_df = pd.DataFrame(summary['counts'].most_common(), columns=['Waste Type', 'Count'])
+        st.dataframe(counts_df, use_container_width=True, hide_index=True)
+
+
 # Main function for Streamlit app
 def app():
     # Header with gradient
@@ -39,6 +158,20 @@ def app():
     # Info box
     st.info("📸 Upload an underwater image to detect and identify waste materials. The model can identify 15 different types of waste including plastics, metals, and other debris.")
     
+    with st.expander("⚙️ Dehazing settings"):
+        skip_clear = st.checkbox("Skip dehazing for images that are already clear", value=True)
+        haze_threshold = st.slider("Haze score threshold", 0.0, 0.5, dcp.HAZE_THRESHOLD, 0.01,
+                                   help="Images scoring below this are detected without dehazing",
+                                   disabled=not skip_clear)
+        imgsz = st.slider("Detection size", 320, 1280, pre.INFERENCE_SIZE, 32,
+                          help="Larger finds smaller debris but is slower")
+        dehaze_size = st.slider("Dehazing resolution", 256, 2048, pre.DEHAZE_SIZE, 32,
+                                help="Longest side the guided filter works at, the image keeps its resolution")
+        sliced = st.checkbox("Sliced detection for small debris", value=False,
+                             help="Detects on overlapping tiles of the detection size, slower on large images")
+    if not skip_clear:
+        haze_threshold = None
+
     # Allow the user to upload an image
     file = st.file_uploader("Choose an image file", type=["jpg", "jpeg", "png"], 
                             help="Supported formats: JPG, JPEG, PNG")
@@ -53,10 +186,17 @@ def app():
         status_text.text("📤 Uploading and processing image...")
         progress_bar.progress(20)
         
-        file_bytes = np.asarray(bytearray(file.read()), dtype=np.uint8)
-        input_image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        input_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
-        input_image = cv2.resize(input_image, (416, 416))
+        data = file.getvalue()
+        result_cache = get_result_cache()
+        key = cache_key(data, imgsz=imgsz, dehaze_size=dehaze_size, haze_threshold=haze_threshold, sliced=sliced,
+                        model=inf.model_version(), **pre.DEHAZE_PARAMS)
+        cached = result_cache.get(key)
+        if cached is not None:
+            input_image = cached['input_image']
+        else:
+            file_bytes = np.frombuffer(data, dtype=np.uint8)
+            input_image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+            input_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
         
         progress_bar.progress(40)
         status_text.text("✅ Image processed successfully")
@@ -73,16 +213,24 @@ def app():
         status_text.text("🔧 Removing noise and enhancing image quality...")
         progress_bar.progress(60)
         
-        processed_image = remove_noise(input_image)
+        if cached is not None:
+            processed_image, dehazed, haze = cached['processed_image'], cached['dehazed'], cached['haze']
+        else:
+            processed_image, dehazed, haze = pre.dehaze(input_image, dehaze_size, haze_threshold)
         
         progress_bar.progress(80)
         status_text.text("✅ Image enhancement completed")
         
         # Display processed image
-        st.markdown("### ✨ Enhanced Image (Noise Removed)")
+        if dehazed:
+            st.markdown("### ✨ Enhanced Image (Noise Removed)")
+            caption = "Enhanced image after noise removal"
+        else:
+            st.markdown("### ✨ Image Already Clear (Dehazing Skipped)")
+            caption = f"Haze score {haze:.3f} is below {haze_threshold:.2f}, the original image is used"
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
-            st.image(processed_image, caption="Enhanced image after noise removal")
+            st.image(processed_image, caption=caption)
         
         st.markdown("---")
         
@@ -90,7 +238,18 @@ def app():
         status_text.text("🤖 Running YOLOv8 model for object detection...")
         progress_bar.progress(90)
         
-        output_image, class_names = detect_objects(processed_image)
+        if cached is not None:
+            # already counted in inf.stats when it was first detected
+            output_image, class_names = cached['output_image'], cached['class_names']
+        else:
+            output_image, class_names = detect_objects(processed_image, imgsz, sliced)
+            get_event_log().record('detection', class_names, session=current_session(),
+                                   params={'source': 'image', 'file': file.name, 'imgsz': imgsz,
+                                           'dehaze_size': dehaze_size, 'sliced': sliced, 'dehazed': dehazed,
+                                           'haze_score': haze})
+            result_cache.put(key, {'input_image': input_image, 'processed_image': processed_image,
+                                   'dehazed': dehazed, 'haze': haze,
+                                   'output_image': output_image, 'class_names': class_names})
         
         progress_bar.progress(100)
         status_text.text("✅ Detection completed!")
@@ -148,7 +307,13 @@ def app():
         # Clear progress
         progress_bar.empty()
         status_text.empty()
+        stats = result_cache.stats()
+        st.caption(f"{'⚡ Served from the result cache. ' if cached is not None else ''}"
+                   f"Result cache: {stats['hits']} hit(s), {stats['misses']} miss(es), {stats['items']} image(s) "
+                   f"({stats['bytes'] / 2 ** 20:.0f}MB) in memory")
 
+    st.markdown("---")
+    batch_app(haze_threshold, imgsz, dehaze_size)
 
-
-
+    st.markdown("---")
+    video_app(imgsz, dehaze_size)
@@ -1,9 +1,13 @@
 import streamlit as st
 import pandas as pd
 import os
-import joblib
+from model_registry import registry
+import potability_model
+import prediction_client
 import numpy as np
 from llm_advisor import get_ai_advice
+from detection_stats import current_session
+from event_log import get_event_log
 
 # Get the directory of the current script
 base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -35,7 +39,33 @@ target_variable = 'Target'
 # Define the color options
 color_options = ['Colorless', 'Faint Yellow', 'Light Yellow', 'Near Colorless', 'Yellow', 'NaN']
 
+# 'native' predicts with the XGBoost Booster and NumPy preprocessing (no pycaret
+# needed), 'pipeline' with the pickled PyCaret pipeline
+POTABILITY_BACKEND = os.environ.get('POTABILITY_BACKEND', 'native')
+
+# Potability pipeline, in order of preference
+MODEL_PATHS = [
+    os.path.join(base_dir, 'models', 'Water_Potability', 'xgboost_without_source_month.pkl'),
+    os.path.join(base_dir, 'models', 'Water_Potability', 'xgboost_pipeline.pkl'),
+]
+
 quality = []
+
+
+def load_model():
+    """
+    (path, model) of the potability model: the native Booster if selected and
+    exported, else the first available pipeline. It is loaded once per process
+    by the model registry and reloaded only when the file changes, not on
+    every rerun.
+    """
+    path = potability_model.DEFAULT_BOOSTER_PATH
+    if POTABILITY_BACKEND == 'native' and os.path.exists(potability_model.preprocessing_path(path)):
+        return path, registry.get(path, loader=potability_model.PotabilityModel,
+                                  companions=potability_model.companion_paths(path))
+    return registry.first(MODEL_PATHS)
+
+
 # Create a Streamlit app
 def app2():
     # Header
@@ -52,23 +82,21 @@ def app2():
     st.markdown("---")
     
     # Load the pretrained model pipeline
-    model_path = os.path.join(base_dir, 'models', 'Water_Potability', 'xgboost_without_source_month.pkl')
     try:
-        model = joblib.load(model_path)
+        model_path, model = load_model()
     except FileNotFoundError:
-        # Try alternative path
-        alt_path = os.path.join(base_dir, 'models', 'Water_Potability', 'xgboost_pipeline.pkl')
-        try:
-            model = joblib.load(alt_path)
-        except FileNotFoundError:
-            st.error("""
-                ⚠️ **Model file not found.** 
-                
-                Please ensure the model file exists at:
-                - `models/Water_Potability/xgboost_without_source_month.pkl` or
-                - `models/Water_Potability/xgboost_pipeline.pkl`
-            """)
-            return
+        st.error("""
+            ⚠️ **Model file not found.** 
+            
+            Please ensure the model file exists at:
+            - `models/Water_Potability/xgboost_without_source_month.pkl` or
+            - `models/Water_Potability/xgboost_pipeline.pkl`
+        """)
+        return
+    load_info = registry.info(model_path)
+    st.caption(f"Model loaded once in {load_info['load_seconds'] * 1000:.0f} ms and reused for "
+               f"{load_info['hits']} rerun(s), saving {load_info['saved_seconds']:.1f}s of loading "
+               f"({load_info['load_seconds'] * 1000:.0f} ms per interaction)")
     
     # Info section
     st.info("""
@@ -213,10 +241,14 @@ def app2():
     # Prediction logic
     if predict_btn:
         data = pd.DataFrame(inputs, index=range(0, 1), columns=inputs.keys())
-        # Use pipeline's predict method directly
-        prediction = model.predict(data)
+        # On the prediction server if one is configured, else in-process
+        prediction = prediction_client.predict('potability', data)
+        if prediction is None:
+            prediction = model.predict(data)
         prediction_label = int(prediction[0]) if hasattr(prediction, '__iter__') else int(prediction)
         quality.append(prediction_label)
+        get_event_log().record('potability', [prediction_label], params=data.iloc[0].to_dict(),
+                               session=current_session())
         
         st.markdown("---")
         st.markdown("### 📊 Prediction Result")
@@ -282,10 +314,14 @@ def app2():
         st.markdown("### 🎲 Random Sample Data")
         st.dataframe(data_display, use_container_width=True, hide_index=True)
         
-        # Use pipeline's predict method directly
-        prediction = model.predict(data_display)
+        # On the prediction server if one is configured, else in-process
+        prediction = prediction_client.predict('potability', data_display)
+        if prediction is None:
+            prediction = model.predict(data_display)
         prediction_label = int(prediction[0]) if hasattr(prediction, '__iter__') else int(prediction)
         quality.append(prediction_label)
+        get_event_log().record('potability', [prediction_label], params=data_display.iloc[0].to_dict(),
+                               session=current_session())
         
         st.markdown("### 📊 Prediction Result")
         
@@ -0,0 +1,155 @@
+"""
+Batch dehazing of image directories with dark_channel_prior.haze_removal.
+
+Images are dehazed across a process pool and written to an output directory
+under the same relative path, and the overall throughput is reported.
+
+Usage:
+    python batch_dehaze.py dives/2023/ -o dehazed/
+    python batch_dehaze.py "archive/**/*.jpg" -o dehazed/ --workers 16 --chunksize 8 --unordered
+    python batch_dehaze.py dives/ -o dehazed/ --gf-subsample 4 --low-memory
+    python batch_dehaze.py archive/ -o dehazed/ --haze-threshold 0.12   # copy clear images as they are
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2 as cv
+import numpy as np
+
+import dark_channel_prior as dcp
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+def collect_images(inputs):
+    """
+    Expands directories (recursively) and glob patterns into a sorted list of
+    (source path, output path relative to the output directory) pairs. Output
+    paths are relative to the directory, or to the part of the pattern before
+    its first wildcard, so archive/a/img.jpg and archive/b/img.jpg matched by
+    "archive/**/*.jpg" stay apart. Raises ValueError when two sources from
+    different inputs map to the same output path (e.g. dives/2023 and
+    dives/2024 both holding img1.jpg), instead of one overwriting the other.
+    """
+    jobs = {}
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, files in os.walk(entry):
+                for name in files:
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        jobs[path] = os.path.relpath(path, entry)
+        else:
+            root = os.path.dirname(entry)
+            while glob.has_magic(root):
+                root = os.path.dirname(root)
+            for path in glob.glob(entry, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    jobs[path] = os.path.relpath(path, root or os.curdir)
+    sources = {}
+    for path, rel in sorted(jobs.items()):
+        other = sources.setdefault(os.path.normpath(rel), path)
+        if other != path:
+            raise ValueError(f"{other} and {path} would both be written to {rel}")
+    return sorted(jobs.items())
+
+
+def _init_worker():
+    # one OpenCV thread per process, the pool already uses every core
+    cv.setNumThreads(1)
+
+
+def dehaze_file(job):
+    """
+    Dehazes one image file. job is (source, destination, haze_removal kwargs,
+    haze score threshold or None); images scoring below the threshold are
+    written without dehazing. Returns (source, error message or None,
+    whether it was dehazed).
+    """
+    src, dst, params, haze_threshold = job
+    try:
+        img = cv.imread(src, cv.IMREAD_COLOR)
+        if img is None:
+            return src, 'could not be read', False
+        img = cv.cvtColor(img, cv.COLOR_BGR2RGB)
+        if haze_threshold is None:
+            dehazed, ran = dcp.haze_removal(img, **params)[0], True
+        else:
+            dehazed, ran, _ = dcp.haze_removal_gated(img, haze_threshold, **params)
+        dehazed = cv.cvtColor(dehazed.astype(np.uint8), cv.COLOR_RGB2BGR)
+        os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+        if not cv.imwrite(dst, dehazed):
+            return src, 'could not be written', ran
+    except Exception as e:
+        return src, str(e), False
+    return src, None, ran
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='image directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', required=True)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='pool size (default: all cores)')
+    parser.add_argument('--chunksize', type=int, default=4, help='images handed to a worker at a time')
+    parser.add_argument('--unordered', action='store_true', help='report results as soon as they finish')
+    parser.add_argument('--overwrite', action='store_true', help='redo images that already have an output')
+    parser.add_argument('--w-size', type=int, default=15)
+    parser.add_argument('--a-omega', type=float, default=0.95)
+    parser.add_argument('--gf-w-size', type=int, default=200)
+    parser.add_argument('--eps', type=float, default=1e-6)
+    parser.add_argument('--gf-subsample', type=int, default=1)
+    parser.add_argument('--low-memory', action='store_true')
+    parser.add_argument('--haze-threshold', type=float, default=0,
+                        help=f'skip dehazing images with a lower haze score (e.g. {dcp.HAZE_THRESHOLD}), '
+                             f'default 0 dehazes everything')
+    args = parser.parse_args(argv)
+
+    params = {
+        'w_size': args.w_size,
+        'a_omega': args.a_omega,
+        'gf_w_size': args.gf_w_size,
+        'eps': args.eps,
+        'gf_subsample': args.gf_subsample,
+        'low_memory': args.low_memory,
+    }
+    try:
+        images = collect_images(args.inputs)
+    except ValueError as e:
+        parser.error(str(e))
+    jobs = []
+    for src, rel in images:
+        dst = os.path.join(args.output_dir, rel)
+        if args.overwrite or not os.path.exists(dst):
+            jobs.append((src, dst, params, args.haze_threshold or None))
+    if not jobs:
+        print("No images to process.")
+        return 0
+
+    print(f"Dehazing {len(jobs)} image(s) with {args.workers} worker(s)...")
+    failed = skipped = 0
+    start = time.perf_counter()
+    with Pool(args.workers, initializer=_init_worker) as pool:
+        run = pool.imap_unordered if args.unordered else pool.imap
+        for done, (src, error, ran) in enumerate(run(dehaze_file, jobs, chunksize=args.chunksize), 1):
+            skipped += error is None and not ran
+            if error is not None:
+                failed += 1
+                print(f"  {src}: {error}", file=sys.stderr)
+            if done % 100 == 0 or done == len(jobs):
+                elapsed = time.perf_counter() - start
+                print(f"  {done}/{len(jobs)} done, {done / elapsed:.2f} images/s")
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {len(jobs) - failed} image(s), {failed} failed, in {elapsed:.1f}s "
+          f"({len(jobs) / elapsed:.2f} images/s)")
+    if skipped:
+        print(f"{skipped} clear image(s) were copied without dehazing")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
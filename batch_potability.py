@@ -0,0 +1,178 @@
+"""
+Bulk water potability scoring of CSV or Parquet files.
+
+The input (columns like test_data/test_df, extra columns are ignored) is
+streamed in chunks, each chunk is scored in one vectorized call of
+potability_model.PotabilityModel across a process pool, and the predictions
+are appended to a Parquet file in input order. At most a few chunks per
+worker are in flight, so memory stays bounded however large the input is.
+
+Output columns:
+    row         -> row number in the input
+    Prediction  -> 0 fit for use / 1 polluted
+    Probability -> probability of 1
+    plus the input columns with --keep-columns
+
+Usage:
+    python batch_potability.py samples.csv -o scores.parquet
+    python batch_potability.py lab_export.parquet -o scores.parquet --workers 8 --chunk-rows 200000
+    python batch_potability.py samples.csv -o scores.parquet --keep-columns pH Color
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing import get_context
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+import potability_model as pm
+
+# a pool only pays off with cores to spare for the reading and writing in this process;
+# cpu_count is None when it can't be determined
+_cpus = os.cpu_count() or 1
+DEFAULT_WORKERS = _cpus if _cpus > 1 else 0
+
+_model = None
+
+
+def _init_worker(booster_path):
+    # one model per process, single-threaded since the pool uses every core
+    global _model
+    _model = pm.PotabilityModel(booster_path, nthread=1)
+
+
+def column_types(booster_path=pm.DEFAULT_BOOSTER_PATH):
+    """
+    {column: Arrow type} of the model inputs, so a CSV block where a column
+    happens to be empty isn't read with a different type.
+    """
+    with open(pm.preprocessing_path(booster_path)) as f:
+        preprocessing = json.load(f)
+    types = {col: pa.float64() for col in preprocessing['numeric']['columns']}
+    types.update({col: pa.string() for col in preprocessing['categorical']})
+    return types
+
+
+def read_chunks(path, chunk_rows, types=None):
+    """
+    Yields the input file as DataFrames of about chunk_rows rows, read with
+    pyarrow's streaming readers (multi-threaded for CSV). types are Arrow
+    column types of CSV columns.
+    """
+    if path.lower().endswith(('.parquet', '.pq')):
+        reader = pq.ParquetFile(path).iter_batches(batch_size=chunk_rows)
+    else:
+        # empty cells are missing values, as with pandas.read_csv, not empty strings.
+        # Unlike a pyarrow dataset, the streaming reader only reads a few blocks ahead.
+        options = pacsv.ConvertOptions(column_types=types or {}, strings_can_be_null=True)
+        reader = pacsv.open_csv(path, convert_options=options)
+    batches, rows = [], 0
+    # CSV batches follow the reader's block size, gather them into chunks
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_rows:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, rows = [], 0
+    if rows:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+
+def score_chunk(job):
+    """
+    Scores one chunk. job is (first row number, DataFrame, columns to keep).
+    Returns the output table of the chunk.
+    """
+    start, chunk, keep = job
+    proba = _model.predict_proba(chunk)
+    scores = pd.DataFrame({
+        'row': pd.RangeIndex(start, start + len(chunk)),
+        'Prediction': (proba > _model.threshold).astype('int8'),
+        'Probability': proba.astype('float32'),
+    })
+    for col in keep:
+        scores[col] = chunk[col].to_numpy()
+    return pa.Table.from_pandas(scores, preserve_index=False)
+
+
+def score_file(path, output, workers=DEFAULT_WORKERS, chunk_rows=100_000, keep=(),
+               booster_path=pm.DEFAULT_BOOSTER_PATH, progress=None):
+    """
+    Scores path into the Parquet file output. workers=0 scores in this
+    process. progress(rows, elapsed) is called after every chunk. Returns
+    (rows, elapsed seconds).
+    """
+    writer = None
+    rows = 0
+    start = time.perf_counter()
+
+    def write(table):
+        nonlocal writer, rows
+        if writer is None:
+            writer = pq.ParquetWriter(output, table.schema)
+        writer.write_table(table)
+        rows += table.num_rows
+        if progress:
+            progress(rows, time.perf_counter() - start)
+
+    def jobs():
+        first = 0
+        for chunk in read_chunks(path, chunk_rows, column_types(booster_path)):
+            yield first, chunk, list(keep)
+            first += len(chunk)
+
+    try:
+        if workers == 0:
+            _init_worker(booster_path)
+            for job in jobs():
+                write(score_chunk(job))
+        else:
+            # spawn, like pipeline.py: fork would copy the parent's threads and model state
+            with get_context('spawn').Pool(workers, initializer=_init_worker, initargs=(booster_path,)) as pool:
+                pending = deque()
+                for job in jobs():
+                    pending.append(pool.apply_async(score_chunk, (job,)))
+                    # Pool.imap would read the whole input ahead, keep two chunks per worker instead
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft().get())
+                while pending:
+                    write(pending.popleft().get())
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='CSV or Parquet (.parquet, .pq) file')
+    parser.add_argument('-o', '--output', required=True, help='Parquet file to write')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='pool size (default: all cores, 0 scores in this process)')
+    parser.add_argument('--chunk-rows', type=int, default=100_000, help='rows scored per call')
+    parser.add_argument('--keep-columns', nargs='*', default=[], help='input columns copied to the output')
+    parser.add_argument('--booster', default=pm.DEFAULT_BOOSTER_PATH)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.input):
+        print(f"{args.input} not found", file=sys.stderr)
+        return 1
+
+    def progress(rows, elapsed):
+        print(f"  {rows:,} rows, {rows / elapsed:,.0f} rows/s")
+
+    print(f"Scoring {args.input} with {args.workers} worker(s), {args.chunk_rows:,} rows per chunk...")
+    rows, elapsed = score_file(args.input, args.output, args.workers, args.chunk_rows, args.keep_columns,
+                               args.booster, progress)
+    print(f"Scored {rows:,} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s) -> {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
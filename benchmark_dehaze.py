@@ -0,0 +1,309 @@
+"""
+Benchmark for the dark channel prior dehazing pipeline.
+
+Compares the vectorized guided filter in dark_channel_prior.py against the
+original per-pixel np.linalg.inv loop, checks that both give the same output
+and reports the speedup at 416x416, 1080p and 4K. It also times the full
+haze_removal pipeline for each fast guided filter subsampling ratio and
+reports the deviation from the exact filter on synthetic and real images,
+and times the dark channel engine against scipy's generic (w, w, 3)
+footprint minimum_filter for several patch sizes. Finally it checks the low_memory mode against the
+default one on real images (transmission and dehazed output, at full size
+and 416x416) and measures the peak resident set size of haze_removal in
+both modes, each run in a fresh process.
+
+The haze_score gate is timed against a full haze_removal, and with --haze-dir
+it is run over a real archive to report how many images (and how much dehaze
+time) a threshold would skip.
+
+Usage:
+    python benchmark_dehaze.py
+    python benchmark_dehaze.py --repeat 5 --reference-max-pixels 500000
+    python benchmark_dehaze.py --subsample 1 4 8
+    python benchmark_dehaze.py --skip-memory --haze-dir archive/ --haze-threshold 0.12
+    python benchmark_dehaze.py --parity-images r1/f1.jpeg r1/f2.jpeg r1/f3.jpeg
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+import cv2 as cv
+import numpy as np
+import scipy.ndimage as ndimage
+
+import dark_channel_prior as dcp
+
+SIZES = {
+    '416x416': (416, 416),
+    '1080p': (1080, 1920),
+    '4K': (2160, 3840),
+}
+
+
+def reference_guided_filter(I, p, omega=60, eps=0.01):
+    """
+    Original guided filter, solving one 3x3 system per pixel.
+    Kept here only as the ground truth for the parity check.
+    """
+    w_size = (omega, omega)
+    I = I / 255
+    I_r, I_g, I_b = I[:, :, 0], I[:, :, 1], I[:, :, 2]
+
+    mean_I_r = cv.blur(I_r, w_size)
+    mean_I_g = cv.blur(I_g, w_size)
+    mean_I_b = cv.blur(I_b, w_size)
+
+    mean_p = cv.blur(p, w_size)
+
+    cov_Ip = np.stack([
+        cv.blur(I_r * p, w_size) - mean_I_r * mean_p,
+        cv.blur(I_g * p, w_size) - mean_I_g * mean_p,
+        cv.blur(I_b * p, w_size) - mean_I_b * mean_p,
+    ], axis=-1)
+
+    var_I_rr = cv.blur(I_r * I_r, w_size) - mean_I_r * mean_I_r
+    var_I_rg = cv.blur(I_r * I_g, w_size) - mean_I_r * mean_I_g
+    var_I_rb = cv.blur(I_r * I_b, w_size) - mean_I_r * mean_I_b
+    var_I_gb = cv.blur(I_g * I_b, w_size) - mean_I_g * mean_I_b
+    var_I_gg = cv.blur(I_g * I_g, w_size) - mean_I_g * mean_I_g
+    var_I_bb = cv.blur(I_b * I_b, w_size) - mean_I_b * mean_I_b
+
+    a = np.zeros(I.shape)
+    for x, y in np.ndindex(I.shape[:2]):
+        Sigma = np.array([
+            [var_I_rr[x, y], var_I_rg[x, y], var_I_rb[x, y]],
+            [var_I_rg[x, y], var_I_gg[x, y], var_I_gb[x, y]],
+            [var_I_rb[x, y], var_I_gb[x, y], var_I_bb[x, y]]
+        ])
+        a[x, y, :] = np.linalg.inv(Sigma + eps * np.eye(3)).dot(cov_Ip[x, y, :])
+
+    mean_a = np.stack([cv.blur(a[:, :, c], w_size) for c in range(3)], axis=-1)
+    mean_I = np.stack([mean_I_r, mean_I_g, mean_I_b], axis=-1)
+
+    b = mean_p - np.sum(a * mean_I, axis=2)
+    mean_b = cv.blur(b, w_size)
+    return np.sum(mean_a * I, axis=2) + mean_b
+
+
+def synthetic_hazy_image(shape, seed=0):
+    """
+    Builds a smooth, hazy looking RGB uint8 image of the given (H, W) shape.
+    """
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    scene = rng.integers(0, 256, size=(h // 8 + 1, w // 8 + 1, 3), dtype=np.uint8)
+    scene = cv.resize(scene, (w, h), interpolation=cv.INTER_CUBIC).astype(np.float32)
+    depth = np.linspace(0.2, 0.9, h, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    airlight = np.array([90, 170, 190], dtype=np.float32)
+    hazy = scene * (1 - depth) + airlight * depth
+    return np.clip(hazy, 0, 255).astype(np.uint8)
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_guided_filter(repeat, reference_max_pixels, gf_w_size, eps):
+    print(f"{'size':>10} {'vectorized':>12} {'reference':>12} {'speedup':>9} {'max abs diff':>13}")
+    for name, shape in SIZES.items():
+        img = synthetic_hazy_image(shape).astype(np.int16)
+        alpha_map = dcp.estimate_transmission(img)
+
+        t_fast, q_fast = best_of(lambda: dcp.guided_filter(img, alpha_map, omega=gf_w_size, eps=eps), repeat)
+
+        if np.prod(shape) <= reference_max_pixels:
+            t_ref, q_ref = best_of(lambda: reference_guided_filter(img, alpha_map, omega=gf_w_size, eps=eps), 1)
+            diff = np.abs(q_fast - q_ref).max()
+            np.testing.assert_allclose(q_fast, q_ref, rtol=1e-5, atol=1e-5)
+            print(f"{name:>10} {t_fast:>11.3f}s {t_ref:>11.3f}s {t_ref / t_fast:>8.1f}x {diff:>13.2e}")
+        else:
+            print(f"{name:>10} {t_fast:>11.3f}s {'skipped':>12} {'-':>9} {'-':>13}")
+
+
+def read_rgb(path):
+    img = cv.imread(path, cv.IMREAD_COLOR)
+    return None if img is None else cv.cvtColor(img, cv.COLOR_BGR2RGB)
+
+
+def bench_fast_guided_filter(repeat, subsamples, gf_w_size, eps, paths):
+    print(f"{'image':>14} {'subsample':>10} {'haze_removal':>13} {'max abs diff':>13} {'mean abs diff':>14} "
+          f"{'diff > 10':>10}")
+    images = [(name, synthetic_hazy_image(shape)) for name, shape in SIZES.items()]
+    images += [(path, read_rgb(path)) for path in paths]
+    for name, img in images:
+        if img is None:
+            continue
+        exact = None
+        for s in subsamples:
+            t, (out, _) = best_of(lambda: dcp.haze_removal(img, gf_w_size=gf_w_size, eps=eps, gf_subsample=s), repeat)
+            out = out.astype(np.float64)
+            if exact is None:
+                exact = out
+            diff = np.abs(out - exact)
+            print(f"{name:>14} {s:>10} {t:>12.3f}s {diff.max():>13.1f} {diff.mean():>14.3f} "
+                  f"{(diff > 10).mean():>10.2%}")
+
+
+def bench_dark_channel(repeat, w_sizes):
+    print(f"{'size':>10} {'w_size':>7} {'uint8':>9} {'float64':>9} {'scipy footprint':>16}")
+    for name, shape in SIZES.items():
+        img = synthetic_hazy_image(shape)
+        img_f = img / 255
+        for w in w_sizes:
+            t_u8, dc = best_of(lambda: dcp.get_dark_channel_prior(img, w_size=w), repeat)
+            t_f64, _ = best_of(lambda: dcp.get_dark_channel_prior(img_f, w_size=w), repeat)
+            t_ref, ref = best_of(
+                lambda: ndimage.minimum_filter(img, footprint=np.ones((w, w, 3)), mode='nearest')[:, :, 1], 1)
+            assert np.array_equal(dc, ref)
+            print(f"{name:>10} {w:>7} {t_u8:>8.3f}s {t_f64:>8.3f}s {t_ref:>15.3f}s")
+
+
+def bench_haze_score(repeat, haze_dir, threshold, limit):
+    print(f"{'size':>10} {'haze_score':>11} {'haze_removal':>13} {'hazy score':>11} {'dehazed score':>14}")
+    for name, shape in SIZES.items():
+        img = synthetic_hazy_image(shape)
+        t_score, (score, _, _) = best_of(lambda: dcp.haze_score(img), repeat)
+        t_full, (out, _) = best_of(lambda: dcp.haze_removal(img, low_memory=True), 1)
+        print(f"{name:>10} {t_score * 1000:>9.2f}ms {t_full:>12.3f}s {score:>11.3f} "
+              f"{dcp.haze_score(out)[0]:>14.3f}")
+    if not haze_dir:
+        return
+
+    from batch_dehaze import collect_images
+
+    skipped = total = 0
+    saved = spent = 0.0
+    for path, _ in collect_images([haze_dir])[:limit]:
+        img = cv.imread(path, cv.IMREAD_COLOR)
+        if img is None:
+            continue
+        img = cv.cvtColor(img, cv.COLOR_BGR2RGB)
+        start = time.perf_counter()
+        score = dcp.haze_score(img)[0]
+        spent += time.perf_counter() - start
+        total += 1
+        if score < threshold:
+            skipped += 1
+            saved += best_of(lambda: dcp.haze_removal(img), 1)[0]
+    if total:
+        print(f"{haze_dir}: {skipped}/{total} image(s) below {threshold} skip dehazing, "
+              f"saving {saved:.1f}s of haze_removal for {spent:.2f}s of scoring")
+
+
+def bench_low_memory_parity(paths, gf_w_size, eps):
+    print(f"{'image':>14} {'size':>10} {'max |dt|':>9} {'p99 |dt|':>9} {'max |dJ|':>9} {'|dJ| > 10':>10}")
+    for path in paths:
+        img = read_rgb(path)
+        if img is None:
+            print(f"{path:>14} unreadable, skipped")
+            continue
+        for size in (None, (416, 416)):
+            if size is not None:
+                img = cv.resize(img, size, interpolation=cv.INTER_AREA)
+            out, t = dcp.haze_removal(img, gf_w_size=gf_w_size, eps=eps)
+            out_lm, t_lm = dcp.haze_removal(img, gf_w_size=gf_w_size, eps=eps, low_memory=True)
+            dt = np.abs(t - t_lm)
+            dJ = np.abs(out.astype(np.int16) - out_lm)
+            print(f"{path:>14} {'x'.join(map(str, img.shape[:2])):>10} {dt.max():>9.2e} "
+                  f"{np.percentile(dt, 99):>9.2e} {dJ.max():>9} {(dJ > 10).mean():>10.2%}")
+            # recover_scene_radiance truncates to int16 where low_memory rounds, so 1 level is expected
+            assert dt.max() < 1e-4 and dJ.max() <= 1, f"low_memory diverges from the default on {path}"
+
+
+def _peak_rss_mb():
+    # VmHWM belongs to the current address space, whereas ru_maxrss survives
+    # exec and would report the parent's peak in a spawned child
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _reset_peak_rss():
+    # Linux >= 4.0, lets the baseline exclude building the test image
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_worker(shape, kwargs, queue):
+    img = synthetic_hazy_image(shape)
+    _reset_peak_rss()
+    before = _peak_rss_mb()
+    dcp.haze_removal(img, **kwargs)
+    queue.put((before, _peak_rss_mb()))
+
+
+def bench_peak_rss(gf_w_size, eps):
+    modes = {
+        'default': {},
+        'low_memory': {'low_memory': True},
+        'low_memory, subsample 4': {'low_memory': True, 'gf_subsample': 4},
+    }
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'size':>10} {'mode':>24} {'baseline':>10} {'peak':>10} {'pipeline':>10}")
+    for name, shape in SIZES.items():
+        for mode, kwargs in modes.items():
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_peak_rss_worker,
+                               args=(shape, dict(kwargs, gf_w_size=gf_w_size, eps=eps), queue))
+            proc.start()
+            before, after = queue.get()
+            proc.join()
+            print(f"{name:>10} {mode:>24} {before:>8.0f}MB {after:>8.0f}MB {after - before:>8.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions, best run is reported')
+    parser.add_argument('--reference-max-pixels', type=int, default=10_000_000,
+                        help='skip the slow per-pixel reference above this many pixels')
+    parser.add_argument('--gf-w-size', type=int, default=200)
+    parser.add_argument('--eps', type=float, default=1e-6)
+    parser.add_argument('--subsample', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='fast guided filter ratios to compare, the first one is the baseline')
+    parser.add_argument('--dc-w-size', type=int, nargs='+', default=[5, 15, 61],
+                        help='dark channel patch sizes to compare')
+    parser.add_argument('--skip-memory', action='store_true', help='skip the peak RSS comparison')
+    parser.add_argument('--parity-images', nargs='+', default=['r1/f1.jpeg', 'r1/f3.jpeg'],
+                        help='real images to check the fast guided filter and the low_memory mode on')
+    parser.add_argument('--haze-dir', default=None, help='image directory to measure the haze gate on')
+    parser.add_argument('--haze-threshold', type=float, default=dcp.HAZE_THRESHOLD)
+    parser.add_argument('--haze-limit', type=int, default=200, help='images of --haze-dir to use')
+    args = parser.parse_args()
+
+    print("guided_filter")
+    bench_guided_filter(args.repeat, args.reference_max_pixels, args.gf_w_size, args.eps)
+    print()
+    print("haze_removal (fast guided filter)")
+    bench_fast_guided_filter(args.repeat, args.subsample, args.gf_w_size, args.eps, args.parity_images)
+    print()
+    print("get_dark_channel_prior")
+    bench_dark_channel(args.repeat, args.dc_w_size)
+    print()
+    print("low_memory parity")
+    bench_low_memory_parity(args.parity_images, args.gf_w_size, args.eps)
+    if not args.skip_memory:
+        print()
+        print("haze_removal peak RSS")
+        bench_peak_rss(args.gf_w_size, args.eps)
+    print()
+    print("haze_score gate")
+    bench_haze_score(args.repeat, args.haze_dir, args.haze_threshold, args.haze_limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Parity check and latency benchmark for the waste detector backends in
+inference.py.
+
+Runs the same images through every requested backend, checks that the
+detections of each backend match the PyTorch ones (same class, IoU above a
+threshold, close confidence) and reports per-image latency percentiles and
+batched throughput. With --sliced it instead compares plain detection with
+sliced (SAHI-style) detection for every slice size / overlap / batch size
+combination, reporting slices per image, throughput and detections found.
+
+Usage:
+    python benchmark_detection.py path/to/images/
+    python benchmark_detection.py path/to/images/ --backends torch onnx --intra-op-threads 4
+    python benchmark_detection.py "dives/*.jpg" --check   # exit code 1 on a parity failure
+    python benchmark_detection.py 4k_frames/ --size 0 --sliced --slice-size 512 640 --overlap 0.2 --slice-batch 8 16
+"""
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import inference as inf
+from batch_dehaze import collect_images
+
+
+def load_images(inputs, size, limit):
+    images = []
+    for path, _ in collect_images(inputs)[:limit]:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if size:
+            image = cv2.resize(image, (size, size))
+        images.append(image)
+    return images
+
+
+def match_detections(reference, candidate, iou_threshold):
+    """
+    Greedily matches the candidate detections of one image to the reference
+    ones of the same class. Returns (matched, total, largest confidence gap).
+    """
+    total = max(len(reference['class_ids']), len(candidate['class_ids']))
+    if len(reference['class_ids']) == 0 or len(candidate['class_ids']) == 0:
+        return 0, total, 0.0
+    iou = inf._overlap_matrix(reference['boxes'], candidate['boxes'], metric='iou')
+    iou[reference['class_ids'][:, None] != candidate['class_ids'][None, :]] = 0
+    matched, conf_gap = 0, 0.0
+    for i in np.argsort(-reference['confidences']):
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] >= iou_threshold:
+            matched += 1
+            conf_gap = max(conf_gap, abs(float(reference['confidences'][i] - candidate['confidences'][j])))
+            iou[:, j] = 0
+    return matched, total, conf_gap
+
+
+def check_parity(images, backends, model_path, iou_threshold, conf_tolerance):
+    reference = inf.detect_batch(images, batch_size=1, model_path=model_path, backend='torch')
+    ok = True
+    print(f"{'backend':>10} {'matched':>12} {'max conf gap':>13}")
+    for backend in backends:
+        if backend == 'torch':
+            continue
+        detections = inf.detect_batch(images, batch_size=1, model_path=model_path, backend=backend)
+        matched = total = 0
+        conf_gap = 0.0
+        for ref, det in zip(reference, detections):
+            m, t, gap = match_detections(ref, det, iou_threshold)
+            matched, total, conf_gap = matched + m, total + t, max(conf_gap, gap)
+        print(f"{backend:>10} {matched:>5}/{total:<6} {conf_gap:>13.4f}")
+        ok = ok and matched == total and conf_gap <= conf_tolerance
+    return ok
+
+
+def bench_latency(images, backends, model_path, repeat, batch_size):
+    """
+    Prints and returns {backend: (mean latency in ms, batched images/s)}.
+    """
+    timings = {}
+    print(f"{'backend':>10} {'mean':>9} {'p50':>9} {'p95':>9} {'batch img/s':>12}")
+    for backend in backends:
+        inf.warm_up(model_path, backend=backend)
+        latencies = []
+        for _ in range(repeat):
+            for image in images:
+                start = time.perf_counter()
+                inf.detect_batch([image], batch_size=1, model_path=model_path, backend=backend)
+                latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            inf.detect_batch(images, batch_size=batch_size, model_path=model_path, backend=backend)
+        throughput = repeat * len(images) / (time.perf_counter() - start)
+
+        print(f"{backend:>10} {latencies.mean():>7.1f}ms {np.percentile(latencies, 50):>7.1f}ms "
+              f"{np.percentile(latencies, 95):>7.1f}ms {throughput:>12.1f}")
+        timings[backend] = (latencies.mean(), throughput)
+    return timings
+
+
+def bench_sliced(images, backend, model_path, repeat, slice_sizes, overlaps, batch_sizes, imgsz):
+    inf.warm_up(model_path, backend=backend)
+    print(f"{'mode':>24} {'slices':>7} {'ms/img':>9} {'img/s':>7} {'detections':>11}")
+
+    def run(label, fn, slices):
+        found = sum(len(fn(image)['class_ids']) for image in images)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for image in images:
+                fn(image)
+        elapsed = (time.perf_counter() - start) / (repeat * len(images))
+        print(f"{label:>24} {slices:>7.1f} {elapsed * 1000:>7.1f}ms {1 / elapsed:>7.2f} {found:>11}")
+
+    run(f'full frame {imgsz}', lambda image: inf.detect_batch([image], model_path=model_path, backend=backend,
+                                                              imgsz=imgsz)[0], 1)
+    for size in slice_sizes:
+        for overlap in overlaps:
+            slices = np.mean([len(inf.slice_windows(image.shape, size, overlap)) for image in images])
+            for batch_size in batch_sizes:
+                run(f'sliced {size} {overlap:.2f} b{batch_size}',
+                    lambda image: inf.detect_sliced(image, size, overlap, batch_size, model_path=model_path,
+                                                    backend=backend), slices)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='image directories or glob patterns')
+    parser.add_argument('--model', default=inf.DEFAULT_MODEL_PATH, help='.pt weights (default: waste detector)')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'], choices=inf.BACKENDS)
+    parser.add_argument('--size', type=int, default=416, help='resize inputs like app.py does, 0 keeps them')
+    parser.add_argument('--limit', type=int, default=50, help='use at most this many images')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--intra-op-threads', type=int, default=None)
+    parser.add_argument('--inter-op-threads', type=int, default=None)
+    parser.add_argument('--iou', type=float, default=0.9, help='IoU for two detections to count as the same')
+    parser.add_argument('--conf-tolerance', type=float, default=0.02)
+    parser.add_argument('--check', action='store_true', help='exit with code 1 if the parity check fails')
+    parser.add_argument('--sliced', action='store_true', help='benchmark sliced against full frame detection')
+    parser.add_argument('--slice-size', type=int, nargs='+', default=[640])
+    parser.add_argument('--overlap', type=float, nargs='+', default=[0.2])
+    parser.add_argument('--slice-batch', type=int, nargs='+', default=[16])
+    parser.add_argument('--imgsz', type=int, default=640, help='detector size of the full frame baseline')
+    args = parser.parse_args(argv)
+
+    inf.configure_onnx_runtime(intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads)
+    images = load_images(args.inputs, args.size, args.limit)
+    if not images:
+        print("No images found.")
+        return 1
+    print(f"{len(images)} image(s)")
+
+    if args.sliced:
+        for backend in args.backends:
+            print()
+            print(f"sliced detection ({backend})")
+            bench_sliced(images, backend, args.model, args.repeat, args.slice_size, args.overlap,
+                         args.slice_batch, args.imgsz)
+        return 0
+
+    ok = True
+    if 'torch' in args.backends and len(args.backends) > 1:
+        print()
+        print("parity against torch")
+        ok = check_parity(images, args.backends, args.model, args.iou, args.conf_tolerance)
+    print()
+    print("latency")
+    bench_latency(images, args.backends, args.model, args.repeat, args.batch_size)
+    return 0 if ok or not args.check else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
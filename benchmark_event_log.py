@@ -0,0 +1,69 @@
+"""
+Write throughput and report query latency of the event log.
+
+Fills a scratch database with synthetic detection and assessment events,
+spread over the given number of days, then times the aggregate queries the
+Generated Report runs.
+
+Usage:
+    python benchmark_event_log.py
+    python benchmark_event_log.py --events 5000000 --days 365 --db /tmp/events.db
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from event_log import EventLog
+from inference import labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=1_000_000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--db', default=None, help='database file (default: a temporary one)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'events.db')
+        log = EventLog(path, batch_size=args.batch_size)
+        rng = np.random.default_rng(0)
+        now = time.time()
+        ts = now - rng.random(args.events) * args.days * 86400
+        kinds = rng.choice(['detection', 'aquatic', 'potability'], size=args.events, p=[0.8, 0.1, 0.1])
+
+        start = time.perf_counter()
+        for i in range(args.events):
+            if kinds[i] == 'detection':
+                found = rng.integers(0, len(labels), size=rng.integers(0, 4))
+                log.record('detection', [labels[c] for c in found], params={'imgsz': 640}, ts=ts[i])
+            else:
+                log.record(kinds[i], [int(rng.integers(0, 2))], ts=ts[i])
+        log.flush()
+        elapsed = time.perf_counter() - start
+        print(f"wrote {args.events} events in {elapsed:.1f}s ({args.events / elapsed:,.0f} events/s)")
+
+        queries = {
+            'counts by class': lambda: log.counts_by_label('detection'),
+            'counts by class, 7 days': lambda: log.counts_by_label('detection', days=7),
+            'counts by day, 30 days': lambda: log.counts_by_day('detection', days=30),
+            'outcomes (aquatic)': lambda: log.counts_by_label('aquatic'),
+            'outcomes (potability)': lambda: log.counts_by_label('potability'),
+            'latest 20 detections': lambda: log.recent('detection'),
+        }
+        for name, query in queries.items():
+            best = float('inf')
+            for _ in range(5):
+                start = time.perf_counter()
+                query()
+                best = min(best, time.perf_counter() - start)
+            print(f"{name:>26} {best * 1000:>8.2f}ms")
+        log.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Parity check and latency benchmark of the native potability predictor.
+
+Compares potability_model.PotabilityModel with the PyCaret pipeline on
+test_data/test_df (probabilities and classes) and reports single-row latency
+percentiles and batched throughput of both. Without pycaret installed the
+pipeline is replayed from its pickled, fitted scikit-learn imputers, one-hot
+table and XGBClassifier with pandas instead.
+
+If the Booster is compiled (python potability_model.py compile), the
+compiled trees are also checked against the Booster, on test_df with some
+values blanked so missing values take every default direction, and the
+throughput of both engines is reported for each batch size.
+
+Usage:
+    python benchmark_potability.py
+    python benchmark_potability.py --rows 100000 --check   # exit code 1 on a parity failure
+    python benchmark_potability.py --batch-sizes 1 64 4096 --nthread 4
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import potability_model as pm
+
+
+class ReplayedPipeline:
+    """
+    The fitted steps of a pipeline read without pycaret, run with pandas.
+    """
+
+    def __init__(self, pipeline):
+        steps = dict(pipeline.steps)
+        self.numeric = steps['numerical_imputer'].transformer
+        self.categorical = steps['categorical_imputer'].transformer
+        self.onehot = steps['onehot_encoding'].transformer
+        self.classifier = steps['trained_model']
+
+    def predict_proba(self, frame):
+        frame = frame.copy()
+        numeric = list(self.numeric.feature_names_in_)
+        frame[numeric] = self.numeric.transform(frame[numeric])
+        categorical = list(self.categorical.feature_names_in_)
+        frame[categorical] = self.categorical.transform(frame[categorical].astype(object))
+        for ordinal, table in zip(self.onehot.ordinal_encoder.mapping, self.onehot.mapping):
+            codes = frame[ordinal['col']].map(ordinal['mapping']).fillna(-1).astype(int)
+            encoded = table['mapping'].reindex(codes).fillna(0)
+            encoded.index = frame.index
+            frame = pd.concat([frame.drop(columns=ordinal['col']), encoded], axis=1)
+        return self.classifier.predict_proba(frame[self.classifier.get_booster().feature_names])
+
+
+def load_pipeline(path):
+    try:
+        import pycaret  # noqa: F401
+    except ImportError:
+        return ReplayedPipeline(pm.read_pipeline(path)), 'replayed'
+    import joblib
+    return joblib.load(path), 'pycaret'
+
+
+def percentiles(timings):
+    return '  '.join(f"p{q} {np.percentile(timings, q) * 1000:.3f}ms" for q in (50, 90, 99))
+
+
+def compare_engines(frame, args):
+    """
+    Parity of the compiled trees with the Booster and throughput of both per
+    batch size. Returns whether parity failed.
+    """
+    engines = {name: pm.PotabilityModel(args.booster, args.nthread, engine=name) for name in ('booster', 'compiled')}
+    x = engines['booster'].transform(frame).copy()
+    # blank 10% of the values, so splits are taken with missing values both ways
+    blanked = x.copy()
+    blanked[np.random.default_rng(0).random(x.shape) < 0.1] = np.nan
+    x = np.concatenate([x, blanked])
+    expected = engines['booster'].predictor.inplace_predict(x, missing=np.nan)
+    actual = engines['compiled'].predictor.inplace_predict(x, missing=np.nan)
+    diff = np.abs(expected - actual)
+    mismatched = int(((expected > 0.5) != (actual > 0.5)).sum())
+    print(f"parity compiled vs booster on {len(x)} rows: max |dp| {diff.max():.2e}, {mismatched} class mismatches")
+
+    print(f"{'batch':>9} " + ' '.join(f"{name + ' rows/s':>16}" for name in engines) + f" {'speedup':>8}")
+    for size in args.batch_sizes:
+        batch = np.ascontiguousarray(np.resize(x, (size, x.shape[1])))
+        # about a second of work per engine, at least one call
+        calls = max(1, min(10_000, 1_000_000 // size))
+        rates = []
+        for engine in engines.values():
+            engine.predictor.inplace_predict(batch, missing=np.nan)
+            start = time.perf_counter()
+            for _ in range(calls):
+                engine.predictor.inplace_predict(batch, missing=np.nan)
+            rates.append(size * calls / (time.perf_counter() - start))
+        print(f"{size:>9} " + ' '.join(f"{rate:>16,.0f}" for rate in rates) + f" {rates[1] / rates[0]:>7.2f}x")
+    return diff.max() > args.tolerance or mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--test-df', default=pm.os.path.join(pm.base_dir, 'test_data', 'test_df'))
+    parser.add_argument('--pipeline', default=pm.DEFAULT_PIPELINE_PATH)
+    parser.add_argument('--booster', default=pm.DEFAULT_BOOSTER_PATH)
+    parser.add_argument('--rows', type=int, default=0, help='parity rows (default: all of test_df)')
+    parser.add_argument('--single', type=int, default=500, help='single-row predictions to time')
+    parser.add_argument('--tolerance', type=float, default=1e-5, help='largest allowed probability difference')
+    parser.add_argument('--check', action='store_true', help='exit with code 1 on a parity failure')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 10_000, 100_000, 1_000_000],
+                        help='batch sizes of the engine throughput benchmark')
+    parser.add_argument('--nthread', type=int, default=1, help='threads of both engines in the throughput benchmark')
+    args = parser.parse_args()
+
+    frame = pd.read_csv(args.test_df).drop(columns=['Target'], errors='ignore')
+    if args.rows:
+        frame = frame.iloc[:args.rows]
+    # rows the app can produce but test_df may lack: a missing and an unlisted color
+    extra = frame.iloc[:2].copy()
+    extra['Color'] = [np.nan, 'NaN']
+    frame = pd.concat([frame, extra], ignore_index=True)
+
+    pipeline, kind = load_pipeline(args.pipeline)
+    model = pm.PotabilityModel(args.booster, engine='booster')
+    expected = pipeline.predict_proba(frame)[:, 1]
+    actual = model.predict_proba(frame)
+    diff = np.abs(expected - actual)
+    mismatched = int(((expected > 0.5) != (actual > 0.5)).sum())
+    print(f"parity vs {kind} pipeline on {len(frame)} rows: max |dp| {diff.max():.2e}, "
+          f"{mismatched} class mismatches")
+
+    rows = [frame.iloc[[i % len(frame)]] for i in range(args.single)]
+    for name, predict in (('pipeline', pipeline.predict_proba), ('native', model.predict_proba)):
+        timings = []
+        for row in rows:
+            start = time.perf_counter()
+            predict(row)
+            timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        predict(frame)
+        batch = time.perf_counter() - start
+        print(f"{name:>8} single row  {percentiles(timings)}   batch {len(frame) / batch:,.0f} rows/s")
+
+    failed = diff.max() > args.tolerance or mismatched
+    if pm.compiled_trees.is_compiled(args.booster):
+        failed |= compare_engines(frame, args)
+    else:
+        print("no compiled library, run python potability_model.py compile to benchmark it")
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
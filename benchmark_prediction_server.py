@@ -0,0 +1,96 @@
+"""
+Load test of the micro-batching prediction server.
+
+Concurrent clients send single-row requests drawn from test_data/test_df
+and the client-side latency percentiles, the throughput and the server's
+mean batch size are reported. Without --url a server is started in this
+process for every --max-wait-ms value, to pick the batching settings.
+
+Usage:
+    python benchmark_prediction_server.py
+    python benchmark_prediction_server.py --clients 32 --requests 200 --max-wait-ms 0 1 2 5
+    python benchmark_prediction_server.py --url http://127.0.0.1:8600 --model habitat
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+import prediction_client
+import prediction_server as ps
+
+
+def load(url, model, rows, clients, requests_per_client):
+    """
+    Latencies (seconds) of clients threads sending requests_per_client
+    single-row requests each, and the wall time of the whole run.
+    """
+    latencies = [[] for _ in range(clients)]
+
+    def client(i):
+        session = requests.Session()
+        for j in range(requests_per_client):
+            row = rows[(i * requests_per_client + j) % len(rows)]
+            start = time.perf_counter()
+            response = session.post(f'{url}/predict/{model}', json={'rows': [row]}, timeout=30)
+            response.raise_for_status()
+            latencies[i].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.concatenate(latencies), time.perf_counter() - start
+
+
+def report(label, latencies, elapsed, stats):
+    ms = latencies * 1000
+    print(f"{label:>14}  p50 {np.percentile(ms, 50):6.2f}ms  p90 {np.percentile(ms, 90):6.2f}ms  "
+          f"p99 {np.percentile(ms, 99):6.2f}ms  {len(ms) / elapsed:8,.0f} req/s  "
+          f"mean batch {stats['mean_batch_size']:.1f}  server p50 {stats.get('p50_ms', 0):.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help='running server to test (default: start one per setting)')
+    parser.add_argument('--model', choices=['potability', 'habitat'], default='potability')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=100, help='requests per client')
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-wait-ms', type=float, nargs='+', default=[0, 2])
+    args = parser.parse_args()
+
+    frame = pd.read_csv(ps.rbc.test_df_path).drop(columns=['Target'])
+    if args.model == 'habitat':
+        # the rules need every value
+        frame = frame.dropna()
+    rows = prediction_client._records(frame.iloc[:1000])
+
+    if args.url:
+        latencies, elapsed = load(args.url, args.model, rows, args.clients, args.requests)
+        report('server', latencies, elapsed, prediction_client.stats(args.url)[args.model])
+        return
+
+    for max_wait in args.max_wait_ms:
+        server = ps.PredictionServer(('127.0.0.1', 0), args.max_batch, max_wait / 1000)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        try:
+            load(url, args.model, rows, args.clients, 5)   # warm up
+            server.batchers[args.model] = ps.MicroBatcher(server.batchers[args.model].predict_batch,
+                                                          args.max_batch, max_wait / 1000)
+            latencies, elapsed = load(url, args.model, rows, args.clients, args.requests)
+            report(f'wait {max_wait:g}ms', latencies, elapsed, server.batchers[args.model].stats())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Native evaluator of an XGBoost tree ensemble, compiled from its JSON model.
+
+Every tree is flattened into a complete binary tree in heap order (children
+of node i at 2i+1 and 2i+2, leaves above the deepest level repeated below
+it), so evaluating one tree is `depth` steps of
+
+    node = 2 * node + 1 + (x[feature[node]] >= threshold[node])
+
+with no branches on the tree structure. A missing value goes the split's
+default way by reading it as -inf or +inf from a second copy of the row.
+The arrays are written into a C file as constants, compiled once with the
+system C compiler into a shared library next to the model and called with
+ctypes, several rows per tree at a time.
+
+This is the flattened-array alternative to Treelite/TL2cgen, which aren't
+dependencies of this project. It handles gbtree models with numerical
+splits and the binary:logistic objective, which is what the potability
+model is.
+"""
+import ctypes
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+
+# deeper trees make the padded arrays too large, keep those on the Booster
+MAX_DEPTH = 12
+
+KERNEL = r"""
+#define INNER ((1 << DEPTH) - 1)
+#define LEAVES (1 << DEPTH)
+#define BLOCK 64
+
+int32_t num_features(void) { return FEATURES; }
+
+void predict_margin(const float *x, int64_t rows, float *out, int32_t nthread)
+{
+#ifdef _OPENMP
+    #pragma omp parallel for num_threads(nthread) schedule(static)
+#endif
+    for (int64_t start = 0; start < rows; start += BLOCK) {
+        float block[BLOCK * 2 * FEATURES], sum[BLOCK];
+        int32_t node[BLOCK];
+        int32_t n = rows - start < BLOCK ? (int32_t)(rows - start) : BLOCK;
+        for (int32_t r = 0; r < n; r++) {
+            const float *xr = x + (start + r) * FEATURES;
+            float *row = block + r * 2 * FEATURES;
+            for (int32_t f = 0; f < FEATURES; f++) {
+                int missing = isnan(xr[f]);
+                row[f] = missing ? -INFINITY : xr[f];
+                row[FEATURES + f] = missing ? INFINITY : xr[f];
+            }
+            sum[r] = BASE_MARGIN;
+        }
+        for (int32_t t = 0; t < TREES; t++) {
+            const int32_t *ft = feature + t * INNER;
+            const float *th = threshold + t * INNER;
+            const float *lt = leaf + t * LEAVES - INNER;
+            for (int32_t r = 0; r < n; r++)
+                node[r] = 0;
+            for (int32_t d = 0; d < DEPTH; d++)
+                for (int32_t r = 0; r < n; r++)
+                    node[r] = 2 * node[r] + 1 + (block[r * 2 * FEATURES + ft[node[r]]] >= th[node[r]]);
+            for (int32_t r = 0; r < n; r++)
+                sum[r] += lt[node[r]];
+        }
+        for (int32_t r = 0; r < n; r++)
+            out[start + r] = sum[r];
+    }
+}
+"""
+
+
+def library_path(booster_path):
+    """
+    The compiled library that belongs to a Booster file.
+    """
+    return os.path.splitext(booster_path)[0] + '_compiled.so'
+
+
+def is_compiled(booster_path):
+    """
+    Whether the Booster has a compiled library at least as new as itself.
+    """
+    lib = library_path(booster_path)
+    return os.path.exists(lib) and os.path.getmtime(lib) >= os.path.getmtime(booster_path)
+
+
+def _tree_depth(left, right):
+    depth, stack = 0, [(0, 0)]
+    while stack:
+        node, level = stack.pop()
+        depth = max(depth, level)
+        if left[node] != -1:
+            stack += [(left[node], level + 1), (right[node], level + 1)]
+    return depth
+
+
+def flatten(booster_path):
+    """
+    The trees of a Booster JSON file as heap-ordered arrays: a dict of
+    feature (trees, 2^depth - 1) int32 (+num_features where missing values
+    go right), threshold (trees, 2^depth - 1) float32, leaf (trees, 2^depth)
+    float32, depth, num_features and base_margin.
+    """
+    with open(booster_path) as f:
+        learner = json.load(f)['learner']
+    booster = learner['gradient_booster']
+    if booster['name'] != 'gbtree' or learner['objective']['name'] != 'binary:logistic':
+        raise ValueError(f"{booster_path}: only gbtree models with binary:logistic are supported")
+    trees = booster['model']['trees']
+    num_features = int(learner['learner_model_param']['num_feature'])
+    base_score = float(learner['learner_model_param']['base_score'])
+
+    depth = max(_tree_depth(tree['left_children'], tree['right_children']) for tree in trees)
+    if depth > MAX_DEPTH:
+        raise ValueError(f"{booster_path}: trees of depth {depth} are deeper than {MAX_DEPTH}")
+    inner = 2 ** depth - 1
+    feature = np.zeros((len(trees), inner), dtype=np.int32)
+    # unused splits below a leaf, every path under them ends in the same leaf value
+    threshold = np.full((len(trees), inner), np.inf, dtype=np.float32)
+    leaf = np.zeros((len(trees), 2 ** depth), dtype=np.float32)
+    for t, tree in enumerate(trees):
+        if any(tree.get('split_type', [])):
+            raise ValueError(f"{booster_path}: categorical splits are not supported")
+        left, right = tree['left_children'], tree['right_children']
+        stack = [(0, 0, 0)]
+        while stack:
+            node, pos, level = stack.pop()
+            if left[node] == -1:
+                first = last = pos
+                for _ in range(depth - level):
+                    first, last = 2 * first + 1, 2 * last + 2
+                leaf[t, first - inner:last - inner + 1] = tree['split_conditions'][node]
+            else:
+                feature[t, pos] = tree['split_indices'][node] + (0 if tree['default_left'][node] else num_features)
+                threshold[t, pos] = tree['split_conditions'][node]
+                stack += [(left[node], 2 * pos + 1, level + 1), (right[node], 2 * pos + 2, level + 1)]
+    return {
+        'feature': feature,
+        'threshold': threshold,
+        'leaf': leaf,
+        'depth': depth,
+        'num_features': num_features,
+        'base_margin': float(np.log(base_score / (1 - base_score))),
+    }
+
+
+def _c_floats(values):
+    # hexadecimal literals are exact, decimal ones might not round-trip
+    return ', '.join('INFINITY' if np.isinf(v) else float(v).hex() + 'f' for v in values.ravel())
+
+
+def source(trees):
+    """
+    C source of the library for the arrays of flatten.
+    """
+    return '\n'.join([
+        '#include <math.h>',
+        '#include <stdint.h>',
+        f"#define FEATURES {trees['num_features']}",
+        f"#define TREES {len(trees['feature'])}",
+        f"#define DEPTH {trees['depth']}",
+        f"#define BASE_MARGIN {float(np.float32(trees['base_margin'])).hex()}f",
+        f"static const int32_t feature[] = {{{', '.join(map(str, trees['feature'].ravel()))}}};",
+        f"static const float threshold[] = {{{_c_floats(trees['threshold'])}}};",
+        f"static const float leaf[] = {{{_c_floats(trees['leaf'])}}};",
+        KERNEL,
+    ])
+
+
+def compile_booster(booster_path, compiler=None):
+    """
+    Compiles a Booster JSON file into library_path(booster_path), with OpenMP
+    if the compiler supports it. compiler defaults to $CC or cc. Returns the
+    library path.
+    """
+    compiler = compiler or os.environ.get('CC', 'cc')
+    if shutil.which(compiler) is None:
+        raise RuntimeError(f"C compiler {compiler} not found")
+    output = library_path(booster_path)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'trees.c')
+        lib = os.path.join(tmp, 'trees.so')
+        with open(src, 'w') as f:
+            f.write(source(flatten(booster_path)))
+        # -O2 rather than -O3: vectorized gathers made the tree walk slower
+        command = [compiler, '-O2', '-shared', '-fPIC', src, '-o', lib, '-lm']
+        result = subprocess.run(command[:1] + ['-fopenmp'] + command[1:], capture_output=True, text=True)
+        if result.returncode != 0:
+            result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"compiling {booster_path} failed:\n{result.stderr}")
+        # copy then rename, a process loading the library never sees half of it
+        shutil.copyfile(lib, output + '.tmp')
+        os.replace(output + '.tmp', output)
+    return output
+
+
+class CompiledTrees:
+    """
+    booster_path -> Booster JSON file, compiled with compile_booster
+    nthread      -> threads per call (if compiled with OpenMP)
+
+        trees = CompiledTrees('models/Water_Potability/xgboost_model.json')
+        trees.inplace_predict(x)   # like Booster.inplace_predict, x a float32 (n, features) array
+    """
+
+    def __init__(self, booster_path, nthread=1):
+        self.path = library_path(booster_path)
+        self.nthread = nthread
+        self._lib = ctypes.CDLL(self.path)
+        self._lib.predict_margin.argtypes = [
+            np.ctypeslib.ndpointer(np.float32, ndim=2, flags='C_CONTIGUOUS'), ctypes.c_int64,
+            np.ctypeslib.ndpointer(np.float32, ndim=1, flags='C_CONTIGUOUS'), ctypes.c_int32]
+        self._lib.predict_margin.restype = None
+        self.num_features = self._lib.num_features()
+
+    def predict_margin(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if x.ndim != 2 or x.shape[1] != self.num_features:
+            raise ValueError(f"expected an (n, {self.num_features}) array, got {x.shape}")
+        out = np.empty(len(x), dtype=np.float32)
+        self._lib.predict_margin(x, len(x), out, self.nthread)
+        return out
+
+    def inplace_predict(self, x, missing=np.nan):
+        """
+        Probability of class 1 for each row of x; missing values must be NaN.
+        """
+        return 1 / (1 + np.exp(-self.predict_margin(x)))
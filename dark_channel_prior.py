@@ -1,7 +1,8 @@
+from functools import cached_property
+
 import numpy as np
 import cv2 as cv
 import matplotlib.pyplot as plt
-import scipy.ndimage as ndimage
 
 def bgr2rgb(img):
     b,g,r = cv.split(img)
@@ -10,19 +11,63 @@ def bgr2rgb(img):
 # img = bgr2rgb(cv.imread("/content/test3.jpg"))
 
 
+def _min_filter_1d(x, w, axis):
+    """
+    Running minimum of width w along one axis of the 2D array x, with edge
+    replication at the borders (same alignment as scipy's minimum_filter).
+
+    Uses the van Herk/Gil-Werman algorithm: the axis is cut into blocks of w
+    samples, g holds the running minimum from the start of each block and h
+    the one from its end, so every window min(x[i:i + w]) is
+    min(h[i], g[i + w - 1]). This takes a constant number of comparisons per
+    element whatever w is, and keeps the dtype of x.
+    """
+    if w <= 1:
+        return x.copy()
+    n = x.shape[axis]
+    left = w // 2
+    blocks = -(-(n + w - 1) // w)
+    if axis == 0:
+        xb = np.pad(x, ((left, blocks * w - n - left), (0, 0)), mode='edge')
+        xb = xb.reshape(blocks, w, x.shape[1])
+        g = np.minimum.accumulate(xb, axis=1).reshape(blocks * w, x.shape[1])
+        h = np.minimum.accumulate(xb[:, ::-1], axis=1)[:, ::-1].reshape(blocks * w, x.shape[1])
+        return np.minimum(h[:n], g[w - 1:w - 1 + n])
+
+    xb = np.pad(x, ((0, 0), (left, blocks * w - n - left)), mode='edge')
+    xb = xb.reshape(x.shape[0], blocks, w)
+    g = np.minimum.accumulate(xb, axis=2).reshape(x.shape[0], blocks * w)
+    h = np.minimum.accumulate(xb[:, :, ::-1], axis=2)[:, :, ::-1].reshape(x.shape[0], blocks * w)
+    return np.minimum(h[:, :n], g[:, w - 1:w - 1 + n])
+
+
+def _min_filter_2d(x, w):
+    """
+    Separable w x w minimum filter of the 2D array x.
+    """
+    return _min_filter_1d(_min_filter_1d(x, w, axis=0), w, axis=1)
+
+
 def get_dark_channel_prior(img, w_size=15):
     """
     img    -> 3D tensor in RGB format
     w_size -> size of patch to consider (default is 15)
+
+    The minimum over the colour channels is taken first, then a separable
+    w_size x w_size minimum filter is applied with _min_filter_1d, so the
+    runtime does not depend on w_size. Works on any dtype (uint8 included)
+    without upcasting.
     """
-    J_dark = ndimage.minimum_filter(img, footprint=np.ones((w_size, w_size, 3)), mode='nearest')
+    J_dark = np.minimum(np.minimum(img[:, :, 0], img[:, :, 1]), img[:, :, 2])
 
-    return J_dark[:, :, 1]
+    return _min_filter_2d(J_dark, w_size)
 
 
-def estimate_atmospheric_light(img, w_size=15):
+def estimate_atmospheric_light(img, w_size=15, dark_channel=None):
     """
-    img -> 3D tensor in RGB format
+    img          -> 3D tensor in RGB format
+    w_size       -> size of patch for the dark channel (default is 15)
+    dark_channel -> precomputed dark channel of img, to avoid recomputing it
 
     ret ->
         A_r |
@@ -30,43 +75,87 @@ def estimate_atmospheric_light(img, w_size=15):
         A_c |
     """
     size = img.shape[:2]
-    k = int(0.001 * np.prod(size))
-    j_dark = get_dark_channel_prior(img, w_size=w_size)
-    idx = np.argpartition(-j_dark.ravel(), k)[:k]
+    k = max(int(0.001 * np.prod(size)), 1)
+    j_dark = dark_channel
+    if j_dark is None:
+        j_dark = get_dark_channel_prior(img, w_size=w_size)
+    # the k brightest, without negating j_dark, which wraps around for uint8
+    flat = j_dark.ravel()
+    idx = np.argpartition(flat, flat.size - k)[flat.size - k:]
     x, y = np.hsplit(np.column_stack(np.unravel_index(idx, size)), 2)
 
     A = np.array([img[x, y, 0].max(), img[x, y, 1].max(), img[x, y, 2].max()])
     return A
 
 
-def estimate_transmission(img, omega=0.95, w_size=15):
+def estimate_transmission(img, omega=0.95, w_size=15, A=None, dtype=np.float64):
     """
     Estimates the transmission map using the dark channel prior of the normalized image.
     A small fraction, omega, of the haze is kept to retain depth perspective after haze removal.
 
-    img   -> 3D Tensor in RGB format
-    omega -> fraction of haze to keep in image (default is 0.95)
+    img    -> 3D Tensor in RGB format
+    omega  -> fraction of haze to keep in image (default is 0.95)
+    w_size -> size of patch for the dark channel (default is 15)
+    A      -> atmospheric light, estimated from img with w_size if not given
+    dtype  -> floating point type of the returned map (default is float64)
     """
-    A = estimate_atmospheric_light(img)
-    norm_img = img / A
-    norm_img_dc = get_dark_channel_prior(norm_img, w_size=w_size)
+    if A is None:
+        A = estimate_atmospheric_light(img, w_size=w_size)
 
-    return 1 - omega * norm_img_dc
+    # channel minimum of img / A, built one plane at a time
+    norm_img_dc = np.divide(img[:, :, 0], A[0], dtype=dtype)
+    plane = np.empty_like(norm_img_dc)
+    for c in (1, 2):
+        np.divide(img[:, :, c], A[c], out=plane, dtype=dtype)
+        np.minimum(norm_img_dc, plane, out=norm_img_dc)
+    norm_img_dc = _min_filter_2d(norm_img_dc, w_size)
 
+    norm_img_dc *= -omega
+    norm_img_dc += 1
+    return norm_img_dc
 
-def guided_filter(I, p, omega=60, eps=0.01):
+
+def guided_filter(I, p, omega=60, eps=0.01, subsample=1, low_memory=False):
     """
     from http://kaiminghe.com/publications/eccv10guidedfilter.pdf
     and  https://arxiv.org/pdf/1505.00996.pdf
 
-    I     -> guidance image, 3D Tensor in RGB format
-    p     -> filtering input image,
-    omega -> window size (default is 60)
-    eps   -> regularization parameter (default 0.01)
+    I          -> guidance image, 3D Tensor in RGB format
+    p          -> filtering input image,
+    omega      -> window size (default is 60)
+    eps        -> regularization parameter (default 0.01)
+    subsample  -> fast guided filter ratio (default is 1, i.e. exact filter)
+    low_memory -> float32 guidance and output, float64 statistics only (default False)
+
+    With subsample = s > 1 the coefficients a and b are computed on I and p
+    downsampled by s (with the window shrunk to omega / s) and bilinearly
+    upsampled before the final combination with the full resolution guidance,
+    as in He & Sun, "Fast Guided Filter" (2015). This cuts the cost by roughly
+    s^2. Edges still follow the full resolution I, but a and b lose detail
+    finer than about s pixels, so the output drifts from the exact filter as s
+    grows. With the dehazing defaults (omega = 200, eps = 1e-6) the exact
+    filter follows fine texture closely, and on the r1 photos the dehazed
+    image moves visibly: s = 2 changes 3-5% of the pixels by more than 10
+    levels, s = 4 about 6% (up to 171 levels), s = 8 6-15%. Smooth images
+    move by a few levels at most (benchmark_dehaze.py reports both). Scaling
+    eps with s or clamping a didn't reduce the deviation, so use s > 1 where
+    speed matters more than fidelity, e.g. video.
+
+    See _guided_filter_low_memory for the low_memory mode.
     """
+    if low_memory:
+        return _guided_filter_low_memory(I, p, omega=omega, eps=eps, subsample=subsample)
 
     w_size = (omega, omega)
     I = I / 255
+    I_full = I
+    if subsample > 1:
+        full_size = (p.shape[1], p.shape[0])
+        small_size = (max(p.shape[1] // subsample, 1), max(p.shape[0] // subsample, 1))
+        I = cv.resize(I, small_size, interpolation=cv.INTER_AREA)
+        p = cv.resize(p, small_size, interpolation=cv.INTER_AREA)
+        w_size = (max(omega // subsample, 1), max(omega // subsample, 1))
+
     I_r, I_g, I_b = I[:, :, 0], I[:, :, 1], I[:, :, 2]
 
     mean_I_r = cv.blur(I_r, w_size)
@@ -82,7 +171,6 @@ def guided_filter(I, p, omega=60, eps=0.01):
     cov_Ip_r = mean_Ip_r - mean_I_r * mean_p
     cov_Ip_g = mean_Ip_g - mean_I_g * mean_p
     cov_Ip_b = mean_Ip_b - mean_I_b * mean_p
-    cov_Ip = np.stack([cov_Ip_r, cov_Ip_g, cov_Ip_b], axis=-1)
 
     var_I_rr = cv.blur(I_r * I_r, w_size) - mean_I_r * mean_I_r
     var_I_rg = cv.blur(I_r * I_g, w_size) - mean_I_r * mean_I_g
@@ -91,43 +179,133 @@ def guided_filter(I, p, omega=60, eps=0.01):
     var_I_gg = cv.blur(I_g * I_g, w_size) - mean_I_g * mean_I_g
     var_I_bb = cv.blur(I_b * I_b, w_size) - mean_I_b * mean_I_b
 
-    a = np.zeros(I.shape)
-    for x, y in np.ndindex(I.shape[:2]):
-        Sigma = np.array([
-            [var_I_rr[x, y], var_I_rg[x, y], var_I_rb[x, y]],
-            [var_I_rg[x, y], var_I_gg[x, y], var_I_gb[x, y]],
-            [var_I_rb[x, y], var_I_gb[x, y], var_I_bb[x, y]]
-        ])
-        c = cov_Ip[x, y, :]
-
-        a[x, y, :] = np.linalg.inv(Sigma + eps * np.eye(3)).dot(c)
+    a = _guided_filter_coefficients((var_I_rr, var_I_rg, var_I_rb, var_I_gg, var_I_gb, var_I_bb),
+                                    (cov_Ip_r, cov_Ip_g, cov_Ip_b), eps)
 
     mean_a = np.stack([cv.blur(a[:, :, 0], w_size), cv.blur(a[:, :, 1], w_size), cv.blur(a[:, :, 2], w_size)], axis=-1)
     mean_I = np.stack([mean_I_r, mean_I_g, mean_I_b], axis=-1)
 
     b = mean_p - np.sum(a * mean_I, axis=2)
     mean_b = cv.blur(b, w_size)
-    q = np.sum(mean_a * I, axis=2) + mean_b
+    if subsample > 1:
+        mean_a = cv.resize(mean_a, full_size, interpolation=cv.INTER_LINEAR)
+        mean_b = cv.resize(mean_b, full_size, interpolation=cv.INTER_LINEAR)
+    q = np.sum(mean_a * I_full, axis=2) + mean_b
 
     return q
 
 
-def haze_removal(img, w_size=15, a_omega=0.95, gf_w_size=200, eps=1e-6):
+def _guided_filter_coefficients(var, cov, eps):
     """
-    Implements the haze removal pipeline from
-    Single Image Haze Removal Using Dark Channel Prior by He et al. (2009)
+    a = (Sigma + eps * U)^-1 cov_Ip at every pixel, as an (h, w, 3) array.
+
+    var -> the (rr, rg, rb, gg, gb, bb) planes of Sigma
+    cov -> the (r, g, b) planes of cov_Ip
+    eps -> regularization parameter
+
+    Sigma + eps * U is symmetric, so every pixel's 3x3 system is solved at once
+    through the closed-form adjugate instead of a per-pixel np.linalg.inv.
+    """
+    var_I_rr, var_I_rg, var_I_rb, var_I_gg, var_I_gb, var_I_bb = var
+    cov_Ip_r, cov_Ip_g, cov_Ip_b = cov
+    s_rr = var_I_rr + eps
+    s_gg = var_I_gg + eps
+    s_bb = var_I_bb + eps
+
+    inv_rr = s_gg * s_bb - var_I_gb * var_I_gb
+    inv_rg = var_I_gb * var_I_rb - var_I_rg * s_bb
+    inv_rb = var_I_rg * var_I_gb - s_gg * var_I_rb
+    inv_gg = s_rr * s_bb - var_I_rb * var_I_rb
+    inv_gb = var_I_rb * var_I_rg - s_rr * var_I_gb
+    inv_bb = s_rr * s_gg - var_I_rg * var_I_rg
+
+    det = s_rr * inv_rr + var_I_rg * inv_rg + var_I_rb * inv_rb
+
+    return np.stack([
+        inv_rr * cov_Ip_r + inv_rg * cov_Ip_g + inv_rb * cov_Ip_b,
+        inv_rg * cov_Ip_r + inv_gg * cov_Ip_g + inv_gb * cov_Ip_b,
+        inv_rb * cov_Ip_r + inv_gb * cov_Ip_g + inv_bb * cov_Ip_b,
+    ], axis=-1) / det[:, :, np.newaxis]
 
-    I       -> 3D tensor in RGB format
-    w_size  -> window size of local patch (default is 15)
-    a_omega -> fraction of haze to keep in image (default is 0.95)
-    omega   -> window size for guided filter (default is 200)
-    eps     -> regularization parameter for guided filter(default 1e-6)
+
+def _guided_filter_low_memory(I, p, omega=60, eps=0.01, subsample=1):
+    """
+    Version of guided_filter for large frames.
+
+    The window moments are computed one plane at a time in float64 and the
+    3x3 systems are solved in strips of rows, so only the moments themselves
+    are full-size float64 arrays; the guidance, a, b and the output are
+    float32. This halves the peak, to about 18 float64 planes (36 float32).
+    The moments can't be float32: E[I^2] - E[I]^2 cancels most of their
+    digits on smooth regions, and with eps = 1e-6 the rounding moved the
+    transmission of r1/f1.jpeg by up to 0.5. Results match guided_filter to
+    within a few 1e-6 on the r1 images (checked by benchmark_dehaze.py).
+    """
+    w_size = (omega, omega)
+    I_full = I
+    if subsample > 1:
+        full_size = (p.shape[1], p.shape[0])
+        small_size = (max(p.shape[1] // subsample, 1), max(p.shape[0] // subsample, 1))
+        I = cv.resize(I.astype(np.float32), small_size, interpolation=cv.INTER_AREA)
+        p = cv.resize(p.astype(np.float32), small_size, interpolation=cv.INTER_AREA)
+        w_size = (max(omega // subsample, 1), max(omega // subsample, 1))
+    # one contiguous float32 plane per channel
+    I = np.ascontiguousarray(I.transpose(2, 0, 1), dtype=np.float32)
+    I *= 1 / 255
+    p = np.ascontiguousarray(p, dtype=np.float32)
+
+    mean_I = [cv.boxFilter(plane, cv.CV_64F, w_size) for plane in I]
+    mean_p = cv.boxFilter(p, cv.CV_64F, w_size)
+    buf = np.empty(p.shape, dtype=np.float64)
+
+    def moment(x, y, mean_x, mean_y):
+        # mean of x * y over each window minus mean_x * mean_y, in float64
+        np.multiply(x, y, out=buf, dtype=np.float64)
+        out = cv.boxFilter(buf, cv.CV_64F, w_size)
+        out -= np.multiply(mean_x, mean_y, out=buf)
+        return out
+
+    cov = [moment(I[c], p, mean_I[c], mean_p) for c in range(3)]
+    var = [moment(I[c], I[d], mean_I[c], mean_I[d]) for c, d in ((0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2))]
+
+    # a and b, in strips of about 64k pixels so the solver's temporaries stay small
+    a = np.empty_like(I)
+    b = np.empty_like(p)
+    step = max(1, (1 << 16) // p.shape[1])
+    for y in range(0, p.shape[0], step):
+        rows = slice(y, y + step)
+        a_rows = _guided_filter_coefficients([v[rows] for v in var], [c[rows] for c in cov], eps)
+        b_rows = mean_p[rows].copy()
+        for c in range(3):
+            b_rows -= a_rows[:, :, c] * mean_I[c][rows]
+            a[c, rows] = a_rows[:, :, c]
+        b[rows] = b_rows
+    del mean_I, mean_p, buf, cov, var
+
+    q = cv.blur(b, w_size)
+    if subsample > 1:
+        q = cv.resize(q, full_size, interpolation=cv.INTER_LINEAR)
+    for c in range(3):
+        mean_a = cv.blur(a[c], w_size)
+        if subsample > 1:
+            mean_a = cv.resize(mean_a, full_size, interpolation=cv.INTER_LINEAR)
+            mean_a *= I_full[:, :, c]
+            mean_a *= 1 / 255
+        else:
+            mean_a *= I[c]
+        q += mean_a
+
+    return q
+
+
+def recover_scene_radiance(img, A, f_alpha_map):
     """
-    img = img.astype(np.int16)
-    A = estimate_atmospheric_light(img, w_size=w_size)
-    alpha_map = estimate_transmission(img, omega=a_omega, w_size=w_size)
-    f_alpha_map = guided_filter(img, alpha_map, omega=gf_w_size, eps=eps)
+    Inverts the haze imaging model J = (I - A) / max(t, 0.1) + A.
 
+    img         -> 3D int16 tensor in RGB format, overwritten in place
+    A           -> atmospheric light in the RGB channels
+    f_alpha_map -> refined transmission map
+    """
     img[:, :, 0] -= A[0]
     img[:, :, 1] -= A[1]
     img[:, :, 2] -= A[2]
@@ -143,5 +321,318 @@ def haze_removal(img, w_size=15, a_omega=0.95, gf_w_size=200, eps=1e-6):
     img = np.maximum(img, 0)
     img = np.minimum(img, 255)
 
-    return img, f_alpha_map
+    return img
+
+
+def _recover_scene_radiance_low_memory(img, A, f_alpha_map):
+    """
+    float32 version of recover_scene_radiance that handles all channels with
+    one broadcast expression and rounds once at the end, instead of
+    truncating every intermediate to int16. Returns a uint8 image.
+    """
+    A = np.asarray(A, dtype=np.float32)
+    z = np.maximum(f_alpha_map, 0.1)
+    J = img.astype(np.float32)
+    J -= A
+    J /= z[:, :, np.newaxis]
+    J += A
+    np.clip(J, 0, 255, out=J)
+    np.rint(J, out=J)
+    return J.astype(np.uint8)
+
+
+class DehazeContext:
+    """
+    Haze removal pipeline for a single image that computes every intermediate
+    at most once and keeps it around for callers that need more than the
+    dehazed image (e.g. the transmission map as a depth/turbidity cue).
+
+    The dark channel of img is computed once for the atmospheric light, and
+    A is handed explicitly to the transmission step instead of being
+    estimated a second time from a fresh dark channel.
+
+        ctx = DehazeContext(img, w_size=15)
+        ctx.dark_channel          -> dark channel of img
+        ctx.atmospheric_light     -> A
+        ctx.transmission          -> raw transmission map
+        ctx.refined_transmission  -> transmission map after the guided filter
+        ctx.dehazed               -> dehazed image
+
+    Arguments are the same as for haze_removal, plus atmospheric_light to
+    reuse a known A (e.g. from a previous video frame) and skip estimating it.
+    """
+
+    def __init__(self, img, w_size=15, a_omega=0.95, gf_w_size=200, eps=1e-6, gf_subsample=1, low_memory=False,
+                 atmospheric_light=None):
+        self.img = np.asarray(img) if low_memory else img.astype(np.int16)
+        self.A = atmospheric_light
+        self.w_size = w_size
+        self.a_omega = a_omega
+        self.gf_w_size = gf_w_size
+        self.eps = eps
+        self.gf_subsample = gf_subsample
+        self.low_memory = low_memory
+
+    @cached_property
+    def dark_channel(self):
+        return get_dark_channel_prior(self.img, w_size=self.w_size)
+
+    @cached_property
+    def atmospheric_light(self):
+        if self.A is not None:
+            return self.A
+        return estimate_atmospheric_light(self.img, w_size=self.w_size, dark_channel=self.dark_channel)
+
+    @cached_property
+    def transmission(self):
+        dtype = np.float32 if self.low_memory else np.float64
+        return estimate_transmission(self.img, omega=self.a_omega, w_size=self.w_size, A=self.atmospheric_light,
+                                     dtype=dtype)
+
+    @cached_property
+    def refined_transmission(self):
+        return guided_filter(self.img, self.transmission, omega=self.gf_w_size, eps=self.eps,
+                             subsample=self.gf_subsample, low_memory=self.low_memory)
+
+    @cached_property
+    def dehazed(self):
+        if self.low_memory:
+            return _recover_scene_radiance_low_memory(self.img, self.atmospheric_light, self.refined_transmission)
+        return recover_scene_radiance(self.img.copy(), self.atmospheric_light, self.refined_transmission)
+
+
+def haze_removal(img, w_size=15, a_omega=0.95, gf_w_size=200, eps=1e-6, gf_subsample=1, low_memory=False):
+    """
+    Implements the haze removal pipeline from
+    Single Image Haze Removal Using Dark Channel Prior by He et al. (2009)
+
+    I            -> 3D tensor in RGB format
+    w_size       -> window size of local patch (default is 15)
+    a_omega      -> fraction of haze to keep in image (default is 0.95)
+    omega        -> window size for guided filter (default is 200)
+    eps          -> regularization parameter for guided filter(default 1e-6)
+    gf_subsample -> fast guided filter ratio, see guided_filter (default is 1, exact)
+    low_memory   -> float32 pipeline (float64 guided filter statistics), returns uint8 (default False)
+
+    Use DehazeContext directly to also get the other intermediates.
+    """
+    ctx = DehazeContext(img, w_size=w_size, a_omega=a_omega, gf_w_size=gf_w_size, eps=eps,
+                        gf_subsample=gf_subsample, low_memory=low_memory)
+    return ctx.dehazed, ctx.refined_transmission
+
+
+# haze_score above which dehazing is worth its cost
+HAZE_THRESHOLD = 0.12
+
+
+def haze_score(img, size=128, w_size=3):
+    """
+    Cheap haze / turbidity estimate of an RGB image in [0, 1], computed on a
+    thumbnail whose longest side is size pixels.
+
+    It is the mean of the dark channel (near 0 on clear scenes, high under
+    haze) damped by the RMS contrast of the grey image, since bright but
+    contrasted content like sky also has a high dark channel. Clear images
+    score below ~0.08, visibly hazy ones above ~0.15.
+
+    ret -> (score, dark channel mean in [0, 1], RMS contrast in [0, 0.5])
+    """
+    h, w = img.shape[:2]
+    scale = min(1.0, size / max(h, w))
+    thumb = cv.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv.INTER_AREA)
+    thumb = np.clip(thumb, 0, 255).astype(np.uint8)
+    dark = get_dark_channel_prior(thumb, w_size).mean() / 255
+    contrast = cv.cvtColor(thumb, cv.COLOR_RGB2GRAY).std() / 255
+    return dark * max(0.0, 1 - contrast / 0.25), dark, contrast
+
+
+def haze_removal_gated(img, threshold=HAZE_THRESHOLD, **dehaze_kwargs):
+    """
+    haze_removal, skipped when haze_score(img) is below threshold.
+
+    ret -> (image, whether it was dehazed, haze score); the image is
+           returned unchanged when dehazing was skipped
+    """
+    score = haze_score(img)[0]
+    if score < threshold:
+        return img, False, score
+    return haze_removal(img, **dehaze_kwargs)[0], True, score
 
+
+def _tiles(shape, tile_size, halo, align=1):
+    """
+    Yields (y0, y1, x0, x1) of every tile_size x tile_size tile of an image
+    of the given shape, together with the enclosing window grown by halo
+    pixels on each side (clipped to the image, start aligned to align).
+    """
+    h, w = shape[:2]
+    for y0 in range(0, h, tile_size):
+        for x0 in range(0, w, tile_size):
+            y1, x1 = min(y0 + tile_size, h), min(x0 + tile_size, w)
+            wy0, wx0 = max(y0 - halo, 0), max(x0 - halo, 0)
+            wy0, wx0 = wy0 - wy0 % align, wx0 - wx0 % align
+            yield (y0, y1, x0, x1), (wy0, min(y1 + halo, h), wx0, min(x1 + halo, w))
+
+
+def estimate_atmospheric_light_tiled(src, w_size=15, tile_size=2048):
+    """
+    Same estimate as estimate_atmospheric_light for a uint8 image too large
+    to hold in memory, reading it one tile at a time.
+
+    src       -> uint8 RGB array-like supporting 2D slicing (np.memmap, ...)
+    w_size    -> size of patch for the dark channel (default is 15)
+    tile_size -> tile edge in pixels (default is 2048)
+
+    Instead of keeping the brightest 0.1% of the dark channel, a 256 bin
+    histogram of the dark channel and, for each dark channel value, the
+    largest R, G and B seen with it are accumulated. The threshold for the
+    top 0.1% is read from the histogram at the end, so memory is constant.
+    Pixels tied at the threshold are all included, where argpartition picks
+    an arbitrary subset of them.
+    """
+    hist = np.zeros(256, dtype=np.int64)
+    brightest = np.zeros((256, 3), dtype=np.uint8)
+    for (y0, y1, x0, x1), (wy0, wy1, wx0, wx1) in _tiles(src.shape, tile_size, w_size // 2 + 1):
+        block = np.asarray(src[wy0:wy1, wx0:wx1], dtype=np.uint8)
+        inner = (slice(y0 - wy0, y1 - wy0), slice(x0 - wx0, x1 - wx0))
+        dark = get_dark_channel_prior(block, w_size=w_size)[inner].ravel()
+        pixels = block[inner].reshape(-1, 3)
+        hist += np.bincount(dark, minlength=256)
+        for c in range(3):
+            np.maximum.at(brightest[:, c], dark, pixels[:, c])
+
+    k = max(int(0.001 * src.shape[0] * src.shape[1]), 1)
+    top = np.searchsorted(np.cumsum(hist[::-1]), k)
+    threshold = 255 - min(top, 255)
+    return brightest[threshold:].max(axis=0).astype(np.int16)
+
+
+def haze_removal_tiled(src, dst=None, tile_size=1024, w_size=15, a_omega=0.95, gf_w_size=200, eps=1e-6,
+                       gf_subsample=1, low_memory=True, atmospheric_light=None):
+    """
+    haze_removal for images too large for memory, e.g. seabed photomosaics.
+
+    The image is processed in tile_size x tile_size tiles, each read together
+    with a halo of gf_w_size + w_size pixels, which covers the reach of the
+    dark channel and of both box filters of the guided filter, so the tiles
+    join without seams. A single atmospheric light for the whole image comes
+    from estimate_atmospheric_light_tiled. Peak memory depends on tile_size
+    and the halo only, not on the image size.
+
+    src               -> uint8 RGB array-like supporting 2D slicing, e.g.
+                         np.load(path, mmap_mode='r')
+    dst               -> uint8 array-like to write into, e.g.
+                         np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=src.shape)
+                         (default allocates an in-memory array)
+    tile_size         -> tile edge in pixels, without the halo (default is 1024)
+    atmospheric_light -> known A, estimated from src if not given
+    other arguments are the same as for haze_removal, low_memory defaults to True
+
+    ret -> dst, A
+    """
+    if dst is None:
+        dst = np.empty(src.shape[:2] + (3,), dtype=np.uint8)
+    A = atmospheric_light
+    if A is None:
+        A = estimate_atmospheric_light_tiled(src, w_size=w_size, tile_size=max(tile_size, 2048))
+
+    halo = gf_w_size + w_size
+    for (y0, y1, x0, x1), (wy0, wy1, wx0, wx1) in _tiles(src.shape, tile_size, halo, align=gf_subsample):
+        block = np.asarray(src[wy0:wy1, wx0:wx1])
+        ctx = DehazeContext(block, w_size=w_size, a_omega=a_omega, gf_w_size=gf_w_size, eps=eps,
+                            gf_subsample=gf_subsample, low_memory=low_memory, atmospheric_light=A)
+        dst[y0:y1, x0:x1] = ctx.dehazed[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+        del ctx
+
+    if hasattr(dst, 'flush'):
+        dst.flush()
+    return dst, A
+
+def _scene_thumbnail(frame, size=(64, 36)):
+    return cv.resize(cv.cvtColor(frame, cv.COLOR_RGB2GRAY), size, interpolation=cv.INTER_AREA).astype(np.float32)
+
+
+class StreamDehazer:
+    """
+    Dehazes a stream of video frames, reusing the atmospheric light A across
+    frames instead of estimating it from scratch for every frame.
+
+    A is re-estimated every refresh_every frames, or immediately when the
+    scene changes (mean absolute difference of 64x36 grey thumbnails against
+    the frame A was last estimated on, in [0, 1], above scene_change). New
+    estimates are blended into the running A with weight smoothing, so the
+    output does not flicker; after a scene change the new estimate replaces
+    it outright.
+
+    refresh_every -> frames between re-estimates of A (default is 30)
+    scene_change  -> thumbnail difference that forces a re-estimate (default is 0.15)
+    smoothing     -> weight of a new estimate in the running A (default is 0.2)
+    other keyword arguments are passed to DehazeContext (w_size, gf_w_size, ...)
+
+        dehazer = StreamDehazer(gf_subsample=4, low_memory=True)
+        for frame in dehazer.stream(video_frames('dive.mp4')):
+            ...
+    """
+
+    def __init__(self, refresh_every=30, scene_change=0.15, smoothing=0.2, **dehaze_kwargs):
+        self.refresh_every = refresh_every
+        self.scene_change = scene_change
+        self.smoothing = smoothing
+        self.dehaze_kwargs = dehaze_kwargs
+        self.reset()
+
+    def reset(self):
+        self.A = None
+        self.frames_since_refresh = 0
+        self.reference_thumbnail = None
+        self.refreshes = 0
+
+    def _update_atmospheric_light(self, frame):
+        thumbnail = _scene_thumbnail(frame)
+        cut = (self.reference_thumbnail is None or
+               np.abs(thumbnail - self.reference_thumbnail).mean() / 255 > self.scene_change)
+        if not cut and self.frames_since_refresh < self.refresh_every:
+            self.frames_since_refresh += 1
+            return
+
+        A = estimate_atmospheric_light(frame, w_size=self.dehaze_kwargs.get('w_size', 15)).astype(np.float64)
+        if cut or self.A is None:
+            self.A = A
+        else:
+            self.A = (1 - self.smoothing) * self.A + self.smoothing * A
+        self.reference_thumbnail = thumbnail
+        self.frames_since_refresh = 1
+        self.refreshes += 1
+
+    def context(self, frame):
+        """
+        Updates the running A with frame and returns its DehazeContext.
+        """
+        self._update_atmospheric_light(frame)
+        A = np.rint(self.A).astype(np.int16)
+        return DehazeContext(frame, atmospheric_light=A, **self.dehaze_kwargs)
+
+    def dehaze(self, frame):
+        return self.context(frame).dehazed
+
+    def stream(self, frames):
+        """
+        Lazily yields the dehazed version of every frame in the iterable.
+        """
+        for frame in frames:
+            yield self.dehaze(frame)
+
+
+def video_frames(source):
+    """
+    Yields the frames of a video file (or camera index) as RGB arrays.
+    """
+    capture = cv.VideoCapture(source)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+    finally:
+        capture.release()
@@ -0,0 +1,109 @@
+"""
+Bounded, thread-safe store of waste detection counts.
+
+Replaces a growing list of class names with fixed-size integer arrays
+indexed by class id, so memory stays constant and a report costs the same
+whether there have been ten detections or ten million:
+
+    totals    -> one counter per class since the process started
+    windows   -> a ring of per-minute counters covering the last day, for
+                 time-windowed views (last hour, last 24 hours, ...)
+    sessions  -> per-session totals for the most recently active Streamlit
+                 sessions
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def current_session():
+    """
+    Id of the Streamlit session running the calling thread, or None outside
+    of a Streamlit script run.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+class DetectionStats:
+    """
+    num_classes    -> length of the counter arrays (len(inference.labels))
+    bucket_seconds -> width of one time bucket (default is 60)
+    buckets        -> buckets kept, bucket_seconds * buckets is the longest window (default is one day)
+    max_sessions   -> sessions with their own counters, least recently active ones are dropped first
+
+        stats.add(class_ids)                      # counted for the calling Streamlit session too
+        stats.counts()                            # all time, every session
+        stats.counts(window=3600)                 # last hour
+        stats.counts(session=current_session())   # this session only
+    """
+
+    def __init__(self, num_classes, bucket_seconds=60, buckets=24 * 60, max_sessions=256):
+        self.num_classes = num_classes
+        self.bucket_seconds = bucket_seconds
+        self.max_sessions = max_sessions
+        self._totals = np.zeros(num_classes, dtype=np.int64)
+        self._ring = np.zeros((buckets, num_classes), dtype=np.int64)
+        # absolute bucket number each ring row currently holds
+        self._ring_bucket = np.full(buckets, -1, dtype=np.int64)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, class_ids, session=None, now=None):
+        """
+        Counts one detection per entry of class_ids. session defaults to the
+        calling Streamlit session (none outside of Streamlit).
+        """
+        counts = np.bincount(np.asarray(class_ids, dtype=np.int64).ravel(), minlength=self.num_classes)
+        if counts.shape[0] > self.num_classes:
+            raise ValueError(f"class id {counts.shape[0] - 1} out of range for {self.num_classes} classes")
+        if session is None:
+            session = current_session()
+        bucket = int((time.time() if now is None else now) // self.bucket_seconds)
+        row = bucket % len(self._ring)
+        with self._lock:
+            self._totals += counts
+            if self._ring_bucket[row] != bucket:
+                self._ring[row] = 0
+                self._ring_bucket[row] = bucket
+            self._ring[row] += counts
+            if session is not None:
+                if session not in self._sessions:
+                    self._sessions[session] = np.zeros(self.num_classes, dtype=np.int64)
+                    while len(self._sessions) > self.max_sessions:
+                        self._sessions.popitem(last=False)
+                self._sessions[session] += counts
+                self._sessions.move_to_end(session)
+
+    def counts(self, session=None, window=None, now=None):
+        """
+        Copy of the per-class counts: all time by default, of one session, or
+        of the last window seconds (rounded up to whole buckets). A window is
+        across all sessions; sessions only keep all-time totals.
+        """
+        with self._lock:
+            if session is not None:
+                counts = self._sessions.get(session)
+                return counts.copy() if counts is not None else np.zeros(self.num_classes, dtype=np.int64)
+            if window is None:
+                return self._totals.copy()
+            bucket = int((time.time() if now is None else now) // self.bucket_seconds)
+            oldest = bucket - min(-(-int(window) // self.bucket_seconds), len(self._ring)) + 1
+            recent = (self._ring_bucket >= oldest) & (self._ring_bucket <= bucket)
+            return self._ring[recent].sum(axis=0)
+
+    def total(self, session=None, window=None):
+        return int(self.counts(session, window).sum())
+
+    def reset(self):
+        with self._lock:
+            self._totals[:] = 0
+            self._ring[:] = 0
+            self._ring_bucket[:] = -1
+            self._sessions.clear()
@@ -0,0 +1,89 @@
+"""
+Accuracy and speed of the INT8 waste detector against the FP32 one.
+
+With --data (the YOLOv8 data.yaml of the labelled dataset) both ONNX models
+are validated with Ultralytics and the mAP50 / mAP50-95 change is reported.
+Without labels, the FP32 detections are used as the reference and the share
+of them the INT8 model reproduces is reported instead. Latency and batched
+throughput of both models are measured on the same images.
+
+Usage:
+    python quantize_detector.py path/to/calibration/images/
+    python evaluate_quantized.py --data path/to/data.yaml
+    python evaluate_quantized.py path/to/images/ --intra-op-threads 4
+"""
+import argparse
+import sys
+
+import inference as inf
+from benchmark_detection import bench_latency, load_images, match_detections
+
+
+def validate(onnx_path, data, imgsz):
+    from ultralytics import YOLO
+
+    metrics = YOLO(onnx_path, task='detect').val(data=data, imgsz=imgsz, batch=1, plots=False, verbose=False)
+    return metrics.box.map50, metrics.box.map
+
+
+def agreement(images, model_path, iou_threshold):
+    reference = inf.detect_batch(images, batch_size=1, model_path=model_path, backend='onnx')
+    quantized = inf.detect_batch(images, batch_size=1, model_path=model_path, backend='onnx-int8')
+    matched = total = 0
+    for ref, det in zip(reference, quantized):
+        m, t, _ = match_detections(ref, det, iou_threshold)
+        matched, total = matched + m, total + t
+    return matched, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='*', help='image directories or glob patterns for the speed test '
+                                                  '(default: the validation images of --data)')
+    parser.add_argument('--data', default=None, help='YOLOv8 data.yaml with labelled validation images')
+    parser.add_argument('--model', default=inf.DEFAULT_MODEL_PATH, help='.pt weights (default: waste detector)')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--size', type=int, default=416, help='resize speed test inputs like app.py, 0 keeps them')
+    parser.add_argument('--limit', type=int, default=50, help='speed test images')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--iou', type=float, default=0.5, help='IoU for the unlabelled agreement check')
+    parser.add_argument('--intra-op-threads', type=int, default=None)
+    parser.add_argument('--inter-op-threads', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    inf.configure_onnx_runtime(intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads)
+    fp32_path = inf.export_onnx(args.model, imgsz=args.imgsz)
+    int8_path = inf.quantized_model_path(args.model)
+
+    inputs = args.inputs
+    if not inputs and args.data:
+        from ultralytics.data.utils import check_det_dataset
+        inputs = [check_det_dataset(args.data)['val']]
+    images = load_images(inputs, args.size, args.limit)
+
+    print("accuracy")
+    if args.data:
+        fp32_map50, fp32_map = validate(fp32_path, args.data, args.imgsz)
+        int8_map50, int8_map = validate(int8_path, args.data, args.imgsz)
+        print(f"{'model':>10} {'mAP50':>8} {'mAP50-95':>9}")
+        print(f"{'fp32':>10} {fp32_map50:>8.4f} {fp32_map:>9.4f}")
+        print(f"{'int8':>10} {int8_map50:>8.4f} {int8_map:>9.4f}")
+        print(f"{'change':>10} {int8_map50 - fp32_map50:>+8.4f} {int8_map - fp32_map:>+9.4f}")
+    elif images:
+        matched, total = agreement(images, args.model, args.iou)
+        print(f"no labels given, INT8 reproduces {matched}/{total} FP32 detections at IoU {args.iou}")
+
+    if not images:
+        print("No images for the speed test.")
+        return 1
+    print()
+    print(f"speed ({len(images)} image(s))")
+    timings = bench_latency(images, ['onnx', 'onnx-int8'], args.model, args.repeat, args.batch_size)
+    print(f"INT8 speedup: {timings['onnx'][0] / timings['onnx-int8'][0]:.2f}x latency, "
+          f"{timings['onnx-int8'][1] / timings['onnx'][1]:.2f}x batched throughput")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
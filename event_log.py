@@ -0,0 +1,200 @@
+"""
+Persistent, append-only log of detections and water quality assessments.
+
+Every event is stored in SQLite (WAL mode, so the report can read while
+events are written) with its timestamp, kind, parameters and result. Events
+are buffered and written in batches by a background thread, one transaction
+per batch. Each batch also updates a (kind, day, label) rollup table, so
+the aggregate queries of the Generated Report read a few hundred rollup rows
+instead of scanning millions of events.
+
+Event kinds used by the app:
+    detection  -> labels are the detected class names
+    aquatic    -> rule_based_classifier.is_habitable outcome, '0' habitable / '1' not
+    potability -> app2 model outcome, '0' fit for use / '1' polluted
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.environ.get('EVENT_LOG_PATH', os.path.join(base_dir, 'events.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id      INTEGER PRIMARY KEY,
+    ts      REAL NOT NULL,
+    kind    TEXT NOT NULL,
+    session TEXT,
+    params  TEXT,
+    result  TEXT
+);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+CREATE TABLE IF NOT EXISTS daily_counts (
+    kind  TEXT NOT NULL,
+    day   TEXT NOT NULL,
+    label TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (kind, day, label)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_counts_kind_label ON daily_counts (kind, label, day, count);
+"""
+
+
+class EventLog:
+    """
+    path           -> SQLite database file, created if needed
+    batch_size     -> buffered events that trigger a write
+    flush_interval -> seconds after which buffered events are written anyway
+
+        log = EventLog('events.db')
+        log.record('detection', ['can', 'can', 'glove'], params={'imgsz': 640})
+        log.counts_by_label('detection')   # {'can': 2, 'glove': 1}
+    """
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=256, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._local = threading.local()
+        self._db = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._connect()
+        db.executescript(SCHEMA)
+        db.close()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self, check_same_thread=True):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=check_same_thread)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def _reader(self):
+        # one read connection per thread, SQLite connections aren't shared across threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def record(self, kind, labels, params=None, result=None, session=None, ts=None):
+        """
+        Buffers one event. labels are what the rollup counts (class names or
+        an outcome); params and result are stored as JSON.
+        """
+        labels = [str(label) for label in labels]
+        event = (time.time() if ts is None else ts, kind, session, labels,
+                 json.dumps(params, default=str) if params is not None else None,
+                 json.dumps(result if result is not None else labels, default=str))
+        with self._lock:
+            self._pending.append(event)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Writes every buffered event now, in one transaction.
+        """
+        with self._write_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+            if not events:
+                return
+            rollup = Counter()
+            for ts, kind, _, labels, _, _ in events:
+                day = time.strftime('%Y-%m-%d', time.gmtime(ts))
+                for label in labels:
+                    rollup[kind, day, label] += 1
+            if self._db is None:
+                # used by whichever thread flushes, always under _write_lock
+                self._db = self._connect(check_same_thread=False)
+            with self._db as db:
+                db.executemany('INSERT INTO events (ts, kind, session, params, result) VALUES (?, ?, ?, ?, ?)',
+                               [(ts, kind, session, params, result)
+                                for ts, kind, session, _, params, result in events])
+                db.executemany('INSERT INTO daily_counts (kind, day, label, count) VALUES (?, ?, ?, ?) '
+                               'ON CONFLICT (kind, day, label) DO UPDATE SET count = count + excluded.count',
+                               [(kind, day, label, count) for (kind, day, label), count in rollup.items()])
+
+    def _write_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"event log write failed: {e}")
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    def _since(self, days):
+        if days is None:
+            return '0000-00-00'
+        return time.strftime('%Y-%m-%d', time.gmtime(time.time() - (days - 1) * 86400))
+
+    def counts_by_label(self, kind, days=None):
+        """
+        {label: count} of one event kind, over the last days days (UTC) or all time.
+        """
+        rows = self._reader().execute(
+            'SELECT label, SUM(count) FROM daily_counts WHERE kind = ? AND day >= ? GROUP BY label',
+            (kind, self._since(days)))
+        return dict(rows.fetchall())
+
+    def counts_by_day(self, kind, days=30):
+        """
+        [(day, label, count)] of one event kind for the last days days, oldest first.
+        """
+        rows = self._reader().execute(
+            'SELECT day, label, count FROM daily_counts WHERE kind = ? AND day >= ? ORDER BY day, label',
+            (kind, self._since(days)))
+        return rows.fetchall()
+
+    def event_count(self, kind=None):
+        """
+        Number of stored events, of one kind or in total.
+        """
+        if kind is None:
+            return self._reader().execute('SELECT COUNT(*) FROM events').fetchone()[0]
+        return self._reader().execute('SELECT COUNT(*) FROM events WHERE kind = ?', (kind,)).fetchone()[0]
+
+    def recent(self, kind, limit=20):
+        """
+        The latest events of one kind as dicts, newest first.
+        """
+        rows = self._reader().execute(
+            'SELECT ts, session, params, result FROM events WHERE kind = ? ORDER BY ts DESC LIMIT ?', (kind, limit))
+        return [{'ts': ts, 'session': session, 'params': json.loads(params) if params else None,
+                 'result': json.loads(result) if result else None} for ts, session, params, result in rows]
+
+
+_event_log = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log():
+    """
+    The process-wide EventLog at EVENT_LOG_PATH (default events.db next to this file).
+    """
+    global _event_log
+    if _event_log is None:
+        with _event_log_lock:
+            if _event_log is None:
+                _event_log = EventLog()
+    return _event_log
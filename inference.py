@@ -6,28 +6,442 @@ st.set_option('deprecation.showPyplotGlobalUse', False)
 import torch
 import cv2
 import os
+import threading
+import numpy as np
+from detection_stats import DetectionStats
 
 labels = ['Mask', 'can', 'cellphone', 'electronics', 'gbottle', 'glove', 'metal', 'misc', 'net', 'pbag', 'pbottle',
         'plastic', 'rod', 'sunglasses', 'tire']
 
-garbage = []
+# Detection counts per class id for the report, shared by every session of this process
+stats = DetectionStats(len(labels))
 
-def detect(image):
-    # Get the directory of the current script
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    model_path = os.path.join(base_dir, 'models', 'Underwater_Waste_Detection_YoloV8', '60_epochs_denoised.pt')
+# Get the directory of the current script
+base_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATH = os.path.join(base_dir, 'models', 'Underwater_Waste_Detection_YoloV8', '60_epochs_denoised.pt')
+
+# 'torch' runs the .pt weights through Ultralytics, 'onnx' runs an exported
+# ONNX graph through ONNX Runtime (see export_onnx and configure_onnx_runtime)
+# and 'onnx-int8' runs the INT8 graph written by quantize_detector.py
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+DEFAULT_BACKEND = os.environ.get('WASTE_DETECTOR_BACKEND', 'torch')
+
+# ONNX Runtime session settings, changed through configure_onnx_runtime
+onnx_options = {
+    'intra_op_threads': None,
+    'inter_op_threads': None,
+    'providers': None,
+}
+
+# Process-wide model cache, keyed by (absolute model path, device, backend).
+# Each entry also carries a lock, since an Ultralytics model must not run two
+# predictions at once and Streamlit serves every session from a thread of
+# this process. Loading is serialised per key (_load_locks), _models_lock only
+# guards the two dicts, so a slow ONNX export doesn't hold up other models.
+_models = {}
+_load_locks = {}
+_models_lock = threading.Lock()
+_warmed_up = set()
+
+
+def export_onnx(model_path=None, imgsz=640, force=False):
+    """
+    Exports the .pt weights to ONNX once and caches the result next to them
+    (60_epochs_denoised.pt -> 60_epochs_denoised.onnx). The export is redone
+    when force is True or the .pt file is newer than the cached .onnx.
+
+    The graph has a dynamic batch axis so detect_batch can use it. imgsz
+    should match the size the PyTorch path letterboxes to (640 by default).
+    """
+    model_path = os.path.abspath(model_path or DEFAULT_MODEL_PATH)
+    onnx_path = os.path.splitext(model_path)[0] + '.onnx'
+    if (not force and os.path.exists(onnx_path) and
+            os.path.getmtime(onnx_path) >= os.path.getmtime(model_path)):
+        return onnx_path
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True)
+    if os.path.abspath(exported) != onnx_path:
+        os.replace(exported, onnx_path)
+    return onnx_path
+
+
+def quantized_model_path(model_path=None):
+    """
+    Where quantize_detector.py writes the INT8 model for the given .pt weights
+    (60_epochs_denoised.pt -> 60_epochs_denoised.int8.onnx).
+    """
+    return os.path.splitext(os.path.abspath(model_path or DEFAULT_MODEL_PATH))[0] + '.int8.onnx'
+
+
+def configure_onnx_runtime(intra_op_threads=None, inter_op_threads=None, providers=None):
+    """
+    Sets the ONNX Runtime thread counts and execution providers used for new
+    sessions and drops the cached ONNX models so they pick them up.
+
+    intra_op_threads -> threads used inside one operator (None lets ONNX Runtime decide)
+    inter_op_threads -> threads running independent operators in parallel
+    providers        -> execution providers, default ['CPUExecutionProvider'];
+                        ['OpenVINOExecutionProvider'] with onnxruntime-openvino installed
+    """
+    onnx_options.update(intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads,
+                        providers=providers)
+    with _models_lock:
+        for key in [key for key in _models if key[2].startswith('onnx')]:
+            _models.pop(key)
+            _warmed_up.discard(key)
+
+
+class OnnxRuntimeModel:
+    """
+    Runs an exported YOLOv8 ONNX graph with ONNX Runtime.
+
+    Calling it mirrors calling an Ultralytics YOLO model on a numpy image or a
+    list of them (same letterboxing, channel order, NMS and box rescaling)
+    and returns Ultralytics Results, so detect, detect_batch and the plotting
+    code work the same with either backend.
+    """
+
+    def __init__(self, onnx_path, intra_op_threads=None, inter_op_threads=None, providers=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.session = ort.InferenceSession(onnx_path, options, providers=providers or ['CPUExecutionProvider'])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_dtype = np.float16 if 'float16' in model_input.type else np.float32
+        self.max_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        imgsz = model_input.shape[2:]
+        # a dynamic export accepts any input size that is a multiple of the stride
+        self.dynamic = not all(isinstance(d, int) for d in imgsz)
+        if self.dynamic:
+            metadata = self.session.get_modelmeta().custom_metadata_map
+            imgsz = [int(d) for d in metadata.get('imgsz', '[640, 640]').strip('[]').split(',')]
+        self.imgsz = tuple(imgsz)
+        self._letterboxes = {}
+        self.names = dict(enumerate(labels))
+
+    def _letterbox(self, imgsz=None):
+        if imgsz is None or not self.dynamic:
+            imgsz = self.imgsz
+        elif isinstance(imgsz, int):
+            imgsz = (imgsz, imgsz)
+        imgsz = tuple(-(-int(d) // 32) * 32 for d in imgsz)
+        if imgsz not in self._letterboxes:
+            from ultralytics.data.augment import LetterBox
+            self._letterboxes[imgsz] = LetterBox(imgsz, auto=False, stride=32)
+        return self._letterboxes[imgsz]
+
+    def preprocess(self, images, imgsz=None):
+        """
+        Letterboxes a list of images into one NCHW input batch, the same way
+        the Ultralytics predictor does (it takes numpy input as BGR). imgsz is
+        only honoured by dynamic exports, fixed ones always use their own size.
+        """
+        letterbox = self._letterbox(imgsz)
+        batch = np.stack([letterbox(image=image) for image in images])
+        batch = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2)).astype(self.input_dtype)
+        batch /= 255
+        return batch
+
+    def __call__(self, source, conf=0.25, iou=0.7, max_det=300, classes=None, agnostic_nms=False, imgsz=None,
+                 **kwargs):
+        from ultralytics.engine.results import Results
+        from ultralytics.utils import ops
+
+        images = source if isinstance(source, list) else [source]
+        batch = self.preprocess(images, imgsz)
+
+        step = self.max_batch or len(images)
+        preds = np.concatenate([self.session.run(None, {self.input_name: batch[i:i + step]})[0]
+                                for i in range(0, len(images), step)])
+        preds = ops.non_max_suppression(torch.from_numpy(preds).float(), conf, iou, classes=classes,
+                                        agnostic=agnostic_nms, max_det=max_det)
+
+        results = []
+        for image, pred in zip(images, preds):
+            pred[:, :4] = ops.scale_boxes(batch.shape[2:], pred[:, :4], image.shape)
+            results.append(Results(image, path='image0.jpg', names=self.names, boxes=pred))
+        return results
+
+
+def _model_key(model_path, device, backend):
+    return os.path.abspath(model_path or DEFAULT_MODEL_PATH), device, backend or DEFAULT_BACKEND
+
+
+def model_version(model_path=None, backend=None):
+    """
+    String identifying the weights a prediction was made with (path,
+    modification time and backend), for keying cached results.
+    """
+    path, _, backend = _model_key(model_path, None, backend)
+    if backend == 'onnx-int8':
+        path = quantized_model_path(path)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+    return f"{path}:{mtime:.0f}:{backend}"
+
+
+def _load_model(model_path, device, backend):
+    if backend == 'onnx':
+        return OnnxRuntimeModel(export_onnx(model_path), **onnx_options)
+    if backend == 'onnx-int8':
+        int8_path = quantized_model_path(model_path)
+        if not os.path.exists(int8_path):
+            raise FileNotFoundError(f"{int8_path} not found, create it with: python quantize_detector.py <images>")
+        return OnnxRuntimeModel(int8_path, **onnx_options)
+    if backend != 'torch':
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
     model = YOLO(model_path)
-    results = model(image)
-    class_list = []
+    if device is not None:
+        model.to(device)
+    return model
+
+
+def _get_entry(model_path=None, device=None, backend=None):
+    key = _model_key(model_path, device, backend)
+    entry = _models.get(key)
+    if entry is None:
+        with _models_lock:
+            load_lock = _load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            entry = _models.get(key)
+            if entry is None:
+                entry = (_load_model(*key), threading.Lock())
+                with _models_lock:
+                    _models[key] = entry
+    return entry
+
+
+def get_model(model_path=None, device=None, backend=None):
+    """
+    Returns the model for model_path (default is the waste detector) on
+    device with the given backend (default is DEFAULT_BACKEND), loading it on
+    first use and reusing it for the rest of the process.
+    """
+    return _get_entry(model_path, device, backend)[0]
+
+
+def warm_up(model_path=None, device=None, imgsz=416, backend=None):
+    """
+    Loads the model and runs one dummy prediction so the first real request
+    doesn't pay for weight loading and lazy initialisation. Only the first
+    call per model does any work.
+    """
+    key = _model_key(model_path, device, backend)
+    if key in _warmed_up:
+        return
+    model, lock = _get_entry(model_path, device, backend)
+    with lock:
+        model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), verbose=False)
+    _warmed_up.add(key)
+
+
+def evict_model(model_path=None, device=None, backend=None):
+    """
+    Drops a cached model, or every cached model if no argument is given.
+    The next call loads it again from disk.
+    """
+    with _models_lock:
+        if model_path is None and device is None and backend is None:
+            keys = list(_models)
+        else:
+            keys = [_model_key(model_path, device, backend)]
+        for key in keys:
+            _models.pop(key, None)
+            _warmed_up.discard(key)
+
+
+def reload_model(model_path=None, device=None, backend=None):
+    """
+    Reloads a model from disk, e.g. after its weights have been replaced.
+    """
+    evict_model(model_path, device, backend)
+    return get_model(model_path, device, backend)
+
+
+def _parse_result(result, plot=False):
+    boxes = result.boxes  # Boxes object for bbox outputs
+    class_ids = boxes.cls.cpu().numpy().astype(int)
+    return {
+        'boxes': boxes.xyxy.cpu().numpy(),
+        'confidences': boxes.conf.cpu().numpy(),
+        'class_ids': class_ids,
+        'class_names': [labels[i] for i in class_ids],
+        'image': result.plot() if plot else None,
+    }
+
+
+def detect(image, model_path=None, device=None, backend=None, imgsz=None):
+    model, lock = _get_entry(model_path, device, backend)
+    with lock:
+        results = model(image) if imgsz is None else model(image, imgsz=imgsz)
+    class_ids = []
     for result in results:
-        boxes = result.boxes  # Boxes object for bbox outputs
-        class_list = boxes.cls.tolist()
-    int_list = [int(num) for num in class_list]
-    class_names = [labels[i] for i in int_list]
-    garbage.extend(class_names)
+        class_ids.extend(int(num) for num in result.boxes.cls.tolist())
+    stats.add(class_ids)
+    class_names = [labels[i] for i in class_ids]
     res_plotted = results[0].plot()
     return res_plotted, class_names
 
+
+def detect_batch(images, batch_size=16, plot=False, model_path=None, device=None, backend=None, **predict_kwargs):
+    """
+    Runs the detector over many images, batch_size images per forward pass.
+
+    images         -> iterable of RGB images (numpy arrays)
+    batch_size     -> images per forward pass (default is 16)
+    plot           -> also render the boxes onto a copy of each image (default False)
+    predict_kwargs -> passed on to the Ultralytics model, e.g. conf=0.4, imgsz=640
+
+    ret -> one dict per image, in input order, with
+        boxes       -> (N, 4) float array of xyxy pixel coordinates
+        confidences -> (N,) float array
+        class_ids   -> (N,) int array, indexes into labels
+        class_names -> list of N label names
+        image       -> plotted image, or None when plot is False
+
+    Unlike detect, the results are not added to stats.
+    """
+    model, lock = _get_entry(model_path, device, backend)
+    predict_kwargs.setdefault('verbose', False)
+    detections = []
+    batch = []
+    for image in images:
+        batch.append(image)
+        if len(batch) == batch_size:
+            with lock:
+                results = model(batch, **predict_kwargs)
+            detections.extend(_parse_result(r, plot) for r in results)
+            batch = []
+    if batch:
+        with lock:
+            results = model(batch, **predict_kwargs)
+        detections.extend(_parse_result(r, plot) for r in results)
+    return detections
+
+
+def slice_windows(shape, slice_size=640, overlap=0.2):
+    """
+    (x0, y0, x1, y1) windows of at most slice_size x slice_size covering an
+    image of the given shape, neighbours overlapping by the given fraction.
+    The last row and column are aligned with the image border.
+    """
+    h, w = shape[:2]
+    step = max(1, int(slice_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= slice_size:
+            return [0]
+        positions = list(range(0, length - slice_size, step))
+        return positions + [length - slice_size]
+
+    return [(x, y, min(x + slice_size, w), min(y + slice_size, h)) for y in starts(h) for x in starts(w)]
+
+
+def _overlap_matrix(a, b, metric='ios'):
+    # 'iou' is intersection over union, 'ios' intersection over the smaller box,
+    # which also matches a box cut at a slice border to the whole object
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)[:, None]
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)[None, :]
+    if metric == 'ios':
+        return inter / (np.minimum(area_a, area_b) + 1e-9)
+    return inter / (area_a + area_b - inter + 1e-9)
+
+
+def merge_detections(boxes, confidences, class_ids, method='nms', threshold=0.5, metric='ios'):
+    """
+    Class-aware merging of overlapping detections from different slices.
+
+    method    -> 'nms' keeps the most confident box of each overlapping group,
+                 'wbf' (weighted box fusion) replaces the group by the
+                 confidence-weighted average box with the group's best confidence
+    threshold -> overlap above which two boxes of one class are the same object
+    metric    -> 'ios' (intersection over smaller, default) or 'iou'
+
+    ret -> (boxes, confidences, class_ids) sorted by descending confidence
+    """
+    keep_boxes, keep_conf, keep_cls = [], [], []
+    for cls in np.unique(class_ids):
+        idx = np.flatnonzero(class_ids == cls)
+        idx = idx[np.argsort(-confidences[idx])]
+        b, c = boxes[idx], confidences[idx]
+        overlap = _overlap_matrix(b, b, metric)
+        used = np.zeros(len(idx), dtype=bool)
+        for i in range(len(idx)):
+            if used[i]:
+                continue
+            group = np.flatnonzero(~used & (overlap[i] > threshold))
+            group = np.union1d(group, [i])
+            used[group] = True
+            if method == 'wbf':
+                keep_boxes.append((b[group] * c[group, None]).sum(axis=0) / c[group].sum())
+            else:
+                keep_boxes.append(b[i])
+            keep_conf.append(c[i])
+            keep_cls.append(cls)
+    if not keep_boxes:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+    order = np.argsort(-np.array(keep_conf))
+    return (np.array(keep_boxes, dtype=np.float32)[order], np.array(keep_conf, dtype=np.float32)[order],
+            np.array(keep_cls, dtype=int)[order])
+
+
+def detect_sliced(image, slice_size=640, overlap=0.2, batch_size=16, full_frame=True, merge='nms',
+                  merge_threshold=0.5, merge_metric='ios', plot=False, model_path=None, device=None, backend=None,
+                  **predict_kwargs):
+    """
+    Sliced (SAHI-style) detection for small objects in large images.
+
+    The image is cut into overlapping slice_size tiles that the detector sees
+    at full resolution, all tiles go through the cached model in batches of
+    batch_size, and the detections are shifted back to image coordinates and
+    merged with merge_detections. Compute grows with the number of slices
+    (see slice_windows), so use it for frames well above the detector size.
+
+    full_frame -> also detect on the whole (downscaled) image, for objects larger than a slice
+
+    ret -> one dict like those of detect_batch, boxes in image coordinates
+    """
+    windows = slice_windows(image.shape, slice_size, overlap)
+    crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in windows]
+    offsets = [(x0, y0) for x0, y0, _, _ in windows]
+    if full_frame and len(windows) > 1:
+        crops.append(image)
+        offsets.append((0, 0))
+
+    predict_kwargs.setdefault('imgsz', slice_size)
+    detections = detect_batch(crops, batch_size=batch_size, model_path=model_path, device=device, backend=backend,
+                              **predict_kwargs)
+    boxes = np.concatenate([d['boxes'] + np.array([x, y, x, y], dtype=np.float32)
+                            for d, (x, y) in zip(detections, offsets)])
+    confidences = np.concatenate([d['confidences'] for d in detections])
+    class_ids = np.concatenate([d['class_ids'] for d in detections])
+    boxes, confidences, class_ids = merge_detections(boxes.reshape(-1, 4), confidences, class_ids, merge,
+                                                     merge_threshold, merge_metric)
+
+    plotted = None
+    if plot:
+        from ultralytics.engine.results import Results
+
+        data = torch.from_numpy(np.column_stack([boxes, confidences, class_ids]).astype(np.float32))
+        plotted = Results(image, path='image0.jpg', names=dict(enumerate(labels)), boxes=data).plot()
+    return {
+        'boxes': boxes,
+        'confidences': confidences,
+        'class_ids': class_ids,
+        'class_names': [labels[i] for i in class_ids],
+        'image': plotted,
+        'slices': len(windows),
+    }
+
 # cv2.imshow('res', res_plotted)
 # cv2.waitKey(0)
-# cv2.destroyAllWindows()
\ No newline at end of file
+# cv2.destroyAllWindows()
@@ -2,9 +2,13 @@ import streamlit as st
 import app
 import app2
 import rule_based_classifier as rbc
-from inference import garbage
+import inference as inf
+from detection_stats import current_session
+from event_log import get_event_log
+import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+import logging
 import os
 
 # Custom CSS for modern UI
@@ -104,6 +108,20 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# Load the waste detector once per process, before the first upload; if that
+# fails (no .int8.onnx for WASTE_DETECTOR_BACKEND=onnx-int8, onnxruntime not
+# installed, ...) the pages still load and the detector is loaded on first use
+if os.path.exists(inf.DEFAULT_MODEL_PATH):
+    try:
+        inf.warm_up()
+    except Exception:
+        logging.getLogger(__name__).exception("Warming up the waste detector failed, it is loaded on first use")
+# Same for the potability pipeline; a missing dependency is reported by its page
+try:
+    app2.load_model()
+except (ImportError, FileNotFoundError):
+    pass
+
 labels = ['Mask', 'can', 'cellphone', 'electronics', 'gbottle', 'glove', 'metal', 'misc', 'net', 'pbag', 'pbottle',
           'plastic', 'rod', 'sunglasses', 'tire']
 
@@ -223,7 +241,17 @@ def main():
         
         # Waste Detection Statistics
         st.markdown("### 🗑️ Waste Detection Statistics")
-        occurrences = [garbage.count(labels[i]) for i in range(len(labels))]
+        col1, col2 = st.columns(2)
+        with col1:
+            scope = st.radio("Detections from", ['All sessions', 'This session'], horizontal=True)
+        with col2:
+            windows = {'All time': None, 'Last hour': 3600, 'Last 24 hours': 24 * 3600}
+            period = st.radio("Period", list(windows), horizontal=True, disabled=scope == 'This session',
+                              help="Per-session counts are kept for all time only")
+        if scope == 'This session':
+            occurrences = inf.stats.counts(session=current_session()).tolist()
+        else:
+            occurrences = inf.stats.counts(window=windows[period]).tolist()
         
         if sum(occurrences) > 0:
             col1, col2 = st.columns([2, 1])
@@ -255,6 +283,40 @@ def main():
         
         st.markdown("---")
         
+        # Persistent history from the event log, aggregated from its daily rollup table
+        st.markdown("### 📚 History")
+        event_log = get_event_log()
+        event_log.flush()
+        history_days = {'All time': None, 'Last 7 days': 7, 'Last 30 days': 30}
+        history_period = st.radio("History period", list(history_days), horizontal=True)
+        days = history_days[history_period]
+        by_class = event_log.counts_by_label('detection', days=days)
+        aquatic_outcomes = event_log.counts_by_label('aquatic', days=days)
+        potability_outcomes = event_log.counts_by_label('potability', days=days)
+        
+        if not (by_class or aquatic_outcomes or potability_outcomes):
+            st.info("📝 Nothing recorded yet. Detections and assessments are kept here across restarts.")
+        else:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Waste Items Detected", sum(by_class.values()))
+            col2.metric("Aquatic Life Assessments", sum(aquatic_outcomes.values()),
+                        f"{aquatic_outcomes.get('0', 0)} habitable", delta_color="off")
+            col3.metric("Potability Tests", sum(potability_outcomes.values()),
+                        f"{potability_outcomes.get('0', 0)} fit for use", delta_color="off")
+            if by_class:
+                col1, col2 = st.columns([1, 2])
+                with col1:
+                    class_df = pd.DataFrame(sorted(by_class.items(), key=lambda item: -item[1]),
+                                            columns=['Waste Type', 'Count'])
+                    st.dataframe(class_df, use_container_width=True, hide_index=True)
+                with col2:
+                    daily = pd.DataFrame(event_log.counts_by_day('detection', days=days or 30),
+                                         columns=['Day', 'Waste Type', 'Count'])
+                    st.markdown("**Detections per day**")
+                    st.bar_chart(daily.pivot_table(index='Day', columns='Waste Type', values='Count', fill_value=0))
+        
+        st.markdown("---")
+        
         # Water Quality for Aquatic Life
         st.markdown("### 🐠 Water Quality for Aquatic Life Habitat")
         quality_aquatic = rbc.quality_aquatic
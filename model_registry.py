@@ -0,0 +1,119 @@
+"""
+Process-wide registry of model artifacts loaded from disk.
+
+Each file is deserialized once per process and handed out again on every
+Streamlit rerun. The entry is keyed by the file's absolute path and checked
+against its modification time (and size), and those of the companion files
+the loader also reads, on every lookup, so replacing any of them on disk
+hot-reloads the model on the next request without a restart.
+"""
+import os
+import threading
+import time
+
+import joblib
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ModelRegistry:
+    """
+    loader -> function turning a path into the model (default joblib.load)
+
+        registry = ModelRegistry()
+        model = registry.get('models/Water_Potability/xgboost_pipeline.pkl')
+        registry.info(path)   # load time, loads, hits and the time the hits saved
+    """
+
+    def __init__(self, loader=joblib.load):
+        self.loader = loader
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _path_lock(self, path):
+        with self._lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def get(self, path, loader=None, companions=()):
+        """
+        The model stored at path, loaded on first use and again whenever the
+        file, or one of the companions (other files the loader reads, which
+        may be missing), has changed since. Raises FileNotFoundError if path
+        doesn't exist.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = ((stat.st_mtime_ns, stat.st_size),) + tuple(_file_version(p) for p in companions)
+        entry = self._entries.get(path)
+        if entry is not None and entry['version'] == version:
+            entry['hits'] += 1
+            return entry['model']
+
+        with self._path_lock(path):
+            entry = self._entries.get(path)
+            if entry is not None and entry['version'] == version:
+                entry['hits'] += 1
+                return entry['model']
+            start = time.perf_counter()
+            model = (loader or self.loader)(path)
+            load_seconds = time.perf_counter() - start
+            self._entries[path] = {
+                'model': model,
+                'version': version,
+                'load_seconds': load_seconds,
+                'loads': entry['loads'] + 1 if entry else 1,
+                'hits': entry['hits'] if entry else 0,
+            }
+            return model
+
+    def first(self, paths, loader=None):
+        """
+        (path, model) for the first of paths that exists.
+        """
+        for path in paths:
+            if os.path.exists(path):
+                return path, self.get(path, loader)
+        raise FileNotFoundError(f"none of {', '.join(paths)} exists")
+
+    def warm_up(self, paths, loader=None):
+        """
+        Loads every existing file of paths now, e.g. at application startup.
+        """
+        for path in paths:
+            if os.path.exists(path):
+                self.get(path, loader)
+
+    def info(self, path):
+        """
+        Load statistics of one file: load_seconds (of the last load), loads,
+        hits and saved_seconds (hits x load_seconds), or None if never loaded.
+        """
+        entry = self._entries.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        return {
+            'load_seconds': entry['load_seconds'],
+            'loads': entry['loads'],
+            'hits': entry['hits'],
+            'saved_seconds': entry['hits'] * entry['load_seconds'],
+        }
+
+    def evict(self, path=None):
+        """
+        Drops one file, or every file, so its next get loads it again.
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+
+registry = ModelRegistry()
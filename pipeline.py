@@ -0,0 +1,378 @@
+"""
+Asynchronous decode -> dehaze -> detect pipeline.
+
+Each stage runs concurrently with the others and they are connected by
+bounded queues, so a slow stage holds the earlier ones back instead of
+letting images pile up in memory:
+
+    decode  -> one thread, reads or decodes the image
+    dehaze  -> a process pool running preprocessing.dehaze at the working
+               resolution
+    detect  -> one thread, batches whatever images are ready into the cached
+               model of inference.py at the adaptive inference size
+
+Dehazing (NumPy/OpenCV) and detection (Torch / ONNX Runtime) therefore
+overlap, and the steady-state throughput approaches that of the slowest stage
+instead of the sum of all of them.
+
+Usage:
+    python pipeline.py dives/2023/ --workers 6 --batch-size 8
+    python pipeline.py "archive/**/*.jpg" -o detections.csv --save-dir plotted/ --backend onnx
+    python pipeline.py dives/ --imgsz 1024 --dehaze-size 800   # more small-debris recall, slower
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2 as cv
+import numpy as np
+
+import dark_channel_prior as dcp
+import preprocessing as pre
+from preprocessing import DEHAZE_PARAMS, DEHAZE_SIZE, INFERENCE_SIZE
+
+# marks the end of the stream on a queue
+_DONE = object()
+
+
+def _init_worker():
+    # one OpenCV thread per process, the pool already uses every core
+    cv.setNumThreads(1)
+
+
+def _dehaze(image, working_size, params):
+    """
+    Pool task: returns (dehazed uint8 image, seconds spent).
+    """
+    start = time.perf_counter()
+    dehazed, _, _ = pre.dehaze(image, working_size, **params)
+    return dehazed, time.perf_counter() - start
+
+
+def decode_image(source, max_side=0):
+    """
+    Turns a file path, encoded image bytes or an RGB array into an RGB image,
+    scaled down to max_side if it is larger (0 keeps the original size).
+    """
+    if isinstance(source, np.ndarray):
+        image = source
+    else:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            image = cv.imdecode(np.frombuffer(source, dtype=np.uint8), cv.IMREAD_COLOR)
+        else:
+            image = cv.imread(source, cv.IMREAD_COLOR)
+        if image is None:
+            raise ValueError('could not be decoded')
+        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+    size = pre.fit_size(image.shape, max_side)
+    if size != image.shape[1::-1]:
+        image = cv.resize(image, size, interpolation=cv.INTER_AREA)
+    return image
+
+
+class Pipeline:
+    """
+    Reusable dehaze -> detect pipeline. The process pool is started once and
+    shared by every run() call, so keep one instance around (the UI caches it
+    with st.cache_resource).
+
+    workers      -> dehazing processes (default: all cores but one, which the detector uses)
+    batch_size   -> largest detector batch; smaller batches go through when fewer images are ready
+    queue_size   -> capacity of each queue between stages, bounds the images in flight
+    max_side     -> downscale larger inputs while decoding, 0 keeps the original size
+    dehaze       -> haze_removal kwargs (default DEHAZE_PARAMS), None skips dehazing
+    dehaze_size  -> dehazing working resolution, see preprocessing.dehaze
+    imgsz        -> detector letterbox size, see preprocessing.inference_size
+    plot         -> render the boxes onto each image
+    model_path, device, backend -> which cached detector of inference.py to use
+    """
+
+    def __init__(self, workers=None, batch_size=8, queue_size=16, max_side=0, dehaze=DEHAZE_PARAMS,
+                 dehaze_size=DEHAZE_SIZE, imgsz=INFERENCE_SIZE, plot=False, model_path=None, device=None,
+                 backend=None):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_side = max_side
+        self.dehaze = dict(dehaze) if dehaze is not None else None
+        self.dehaze_size = dehaze_size
+        self.imgsz = imgsz
+        self.plot = plot
+        self.model = {'model_path': model_path, 'device': device, 'backend': backend}
+        self.stats = {}
+        self._pool = None
+        self._run_lock = threading.Lock()
+
+    def start(self):
+        if self._pool is None and self.dehaze is not None:
+            # spawn, not fork: the parent may already run Torch or Streamlit threads
+            context = multiprocessing.get_context('spawn')
+            self._pool = context.Pool(self.workers, initializer=_init_worker)
+        return self
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _decode_stage(self, sources, out, stop):
+        busy = 0.0
+        for index, source in enumerate(sources):
+            start = time.perf_counter()
+            name = source if isinstance(source, str) else f'image{index}'
+            try:
+                item = {'index': index, 'name': name, 'input': decode_image(source, self.max_side)}
+            except Exception as e:
+                item = {'index': index, 'name': name, 'error': str(e)}
+            busy += time.perf_counter() - start
+            if not _put(out, item, stop):
+                break
+        self.stats['decode'] = busy
+        _put(out, _DONE, stop)
+
+    def _dehaze_stage(self, inp, out, stop, haze_threshold, dehaze_size):
+        # submits every image to the pool as soon as it is decoded and passes the
+        # pending result on in order; out being bounded limits the pool's backlog
+        skipped = 0
+        while True:
+            item = _get(inp, stop)
+            if item is _DONE or item is None:
+                break
+            if 'error' not in item:
+                run = self._pool is not None
+                if run and haze_threshold is not None:
+                    item['haze_score'] = dcp.haze_score(item['input'])[0]
+                    run = item['haze_score'] >= haze_threshold
+                    skipped += not run
+                item['dehaze_ran'] = run
+                item['pending'] = self._pool.apply_async(_dehaze, (item['input'], dehaze_size, self.dehaze)) if run else None
+            if not _put(out, item, stop):
+                break
+        self.stats['skipped'] = skipped
+        _put(out, _DONE, stop)
+
+    def _detect_stage(self, inp, out, stop, imgsz):
+        import inference as inf
+
+        busy = dehaze_busy = 0.0
+        done = False
+        while not done:
+            item = _get(inp, stop)
+            if item is _DONE or item is None:
+                break
+            batch = [item]
+            # take whatever else is already waiting, up to batch_size
+            while len(batch) < self.batch_size:
+                try:
+                    item = inp.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+
+            ready = []
+            for item in batch:
+                pending = item.pop('pending', None)
+                if 'error' in item:
+                    continue
+                try:
+                    if pending is None:
+                        item['dehazed'] = item['input']
+                    else:
+                        item['dehazed'], seconds = pending.get()
+                        dehaze_busy += seconds
+                    ready.append(item)
+                except Exception as e:
+                    item['error'] = str(e)
+
+            start = time.perf_counter()
+            if ready:
+                try:
+                    size = max(pre.inference_size(item['dehazed'].shape, imgsz) for item in ready)
+                    detections = inf.detect_batch([item['dehazed'] for item in ready], batch_size=len(ready),
+                                                  plot=self.plot, imgsz=size, **self.model)
+                    for item, detection in zip(ready, detections):
+                        item.update(detection)
+                except Exception as e:
+                    for item in ready:
+                        item['error'] = str(e)
+            busy += time.perf_counter() - start
+            self.stats['batches'] = self.stats.get('batches', 0) + 1
+            for item in batch:
+                if not _put(out, item, stop):
+                    done = True
+                    break
+        self.stats['dehaze'] = dehaze_busy
+        self.stats['detect'] = busy
+        _put(out, _DONE, stop)
+
+    def run(self, sources, haze_threshold=None, imgsz=None, dehaze_size=None):
+        """
+        Streams detection results for sources (file paths, encoded image bytes
+        or RGB arrays), in input order. With a haze_threshold, images whose
+        dark_channel_prior.haze_score is below it skip dehazing. imgsz and
+        dehaze_size override the pipeline's own for this run. Each result is
+        the dict of inference.detect_batch plus
+            index, name -> position in sources and file path (or 'image<index>')
+            input       -> decoded RGB image, boxes are in its coordinates
+            dehazed     -> image the detector saw
+            dehaze_ran  -> whether dehazed was actually dehazed
+            haze_score  -> only present with a haze_threshold
+            error       -> message, only present if the image failed
+
+        Stopping the iteration early shuts the stages down.
+        """
+        with self._run_lock:
+            self.start()
+            self.stats = {'images': 0, 'batches': 0}
+            decoded = queue.Queue(self.queue_size)
+            dehazing = queue.Queue(self.queue_size)
+            results = queue.Queue(self.queue_size)
+            stop = threading.Event()
+            dehaze_args = (decoded, dehazing, stop, haze_threshold, dehaze_size or self.dehaze_size)
+            threads = [
+                threading.Thread(target=self._decode_stage, args=(sources, decoded, stop), daemon=True),
+                threading.Thread(target=self._dehaze_stage, args=dehaze_args, daemon=True),
+                threading.Thread(target=self._detect_stage, args=(dehazing, results, stop, imgsz or self.imgsz),
+                                 daemon=True),
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            try:
+                while True:
+                    item = results.get()
+                    if item is _DONE:
+                        break
+                    self.stats['images'] += 1
+                    yield item
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+                self.stats['elapsed'] = time.perf_counter() - start
+
+    def report(self):
+        """
+        One line summary of the last run: throughput and the busy time of each
+        stage per image (dehaze is summed over the pool's workers).
+        """
+        stats = self.stats
+        images = stats.get('images', 0)
+        elapsed = stats.get('elapsed', 0.0)
+        stages = ", ".join(f"{stage} {stats[stage] / max(images, 1) * 1000:.0f}ms"
+                           for stage in ('decode', 'dehaze', 'detect') if stage in stats)
+        return (f"{images} image(s) in {elapsed:.1f}s ({images / max(elapsed, 1e-9):.2f} images/s), "
+                f"per image: {stages}, {self.workers} dehazing worker(s), "
+                f"{stats.get('skipped', 0)} clear image(s) not dehazed")
+
+
+def _put(q, item, stop):
+    # blocks while q is full (backpressure) but gives up once the run is stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def main(argv=None):
+    import inference as inf
+    from batch_dehaze import collect_images
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='image directories or glob patterns')
+    parser.add_argument('-o', '--output', default=None, help='write every detection to this CSV file')
+    parser.add_argument('--save-dir', default=None, help='write the plotted images to this directory')
+    parser.add_argument('--workers', type=int, default=None, help='dehazing processes (default: cores - 1)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--queue-size', type=int, default=16)
+    parser.add_argument('--max-side', type=int, default=0, help='downscale larger inputs, 0 keeps them')
+    parser.add_argument('--imgsz', type=int, default=INFERENCE_SIZE, help='detector letterbox size')
+    parser.add_argument('--dehaze-size', type=int, default=DEHAZE_SIZE,
+                        help='dehazing working resolution (longest side), 0 for full resolution')
+    parser.add_argument('--no-dehaze', action='store_true')
+    parser.add_argument('--haze-threshold', type=float, default=dcp.HAZE_THRESHOLD,
+                        help='skip dehazing images with a lower haze score, 0 dehazes everything')
+    parser.add_argument('--gf-subsample', type=int, default=1)
+    parser.add_argument('--low-memory', action='store_true')
+    parser.add_argument('--model', default=None, help='.pt weights (default: waste detector)')
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--backend', default=None, choices=inf.BACKENDS)
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = collect_images(args.inputs)
+    except ValueError as e:
+        parser.error(str(e))
+    if not jobs:
+        print("No images found.")
+        return 1
+    relpaths = dict(jobs)
+    dehaze = None if args.no_dehaze else dict(DEHAZE_PARAMS, gf_subsample=args.gf_subsample,
+                                              low_memory=args.low_memory)
+
+    pipeline = Pipeline(args.workers, args.batch_size, args.queue_size, args.max_side, dehaze,
+                        args.dehaze_size, args.imgsz, plot=args.save_dir is not None, model_path=args.model, device=args.device,
+                        backend=args.backend)
+    inf.warm_up(args.model, args.device, imgsz=args.imgsz, backend=args.backend)
+
+    failed = 0
+    out = open(args.output, 'w', newline='') if args.output else None
+    try:
+        writer = csv.writer(out) if out else None
+        if writer:
+            writer.writerow(['image', 'class', 'confidence', 'x1', 'y1', 'x2', 'y2'])
+        with pipeline:
+            print(f"Processing {len(jobs)} image(s) with {pipeline.workers} dehazing worker(s)...")
+            for done, result in enumerate(pipeline.run([src for src, _ in jobs], args.haze_threshold or None), 1):
+                if 'error' in result:
+                    failed += 1
+                    print(f"  {result['name']}: {result['error']}", file=sys.stderr)
+                    continue
+                if writer:
+                    for name, conf, box in zip(result['class_names'], result['confidences'], result['boxes']):
+                        writer.writerow([result['name'], name, f'{conf:.4f}'] + [f'{v:.1f}' for v in box])
+                if args.save_dir:
+                    dst = os.path.join(args.save_dir, relpaths[result['name']])
+                    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+                    cv.imwrite(dst, cv.cvtColor(result['image'], cv.COLOR_RGB2BGR))
+                if done % 100 == 0:
+                    print(f"  {done}/{len(jobs)} done")
+    finally:
+        if out:
+            out.close()
+
+    print(pipeline.report())
+    if failed:
+        print(f"{failed} image(s) failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
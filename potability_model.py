@@ -0,0 +1,242 @@
+"""
+Lean water potability predictor, without PyCaret.
+
+The PyCaret pipeline runs a chain of DataFrame transformers for every
+prediction. This module replays the same fitted preprocessing as NumPy
+operations on a preallocated float32 array and feeds it straight to the
+XGBoost Booster with inplace_predict:
+
+    numeric columns -> missing values filled with the training means
+    Color           -> missing values filled with the most frequent color, then
+                       one-hot encoded (an unknown color, e.g. 'NaN', is all zeros)
+    order           -> the 19 columns the Booster was trained on
+
+The fitted values are exported once from the pipeline pickle into a JSON
+file next to xgboost_model.json (python potability_model.py export), which
+only needs scikit-learn and xgboost, not pycaret. The trees can further be
+compiled into a native library (python potability_model.py compile, see
+compiled_trees.py), which is then used instead of the Booster.
+"""
+import argparse
+import json
+import os
+import threading
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+import compiled_trees
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+model_dir = os.path.join(base_dir, 'models', 'Water_Potability')
+DEFAULT_PIPELINE_PATH = os.path.join(model_dir, 'xgboost_without_source_month.pkl')
+DEFAULT_BOOSTER_PATH = os.path.join(model_dir, 'xgboost_model.json')
+# 'booster', 'compiled' or 'auto' (compiled if its library is present)
+DEFAULT_ENGINE = os.environ.get('POTABILITY_ENGINE', 'auto')
+
+
+def preprocessing_path(booster_path):
+    """
+    The preprocessing file that belongs to a Booster file.
+    """
+    return os.path.splitext(booster_path)[0] + '_preprocessing.json'
+
+
+def companion_paths(booster_path):
+    """
+    The files besides the Booster file that PotabilityModel reads, for
+    model_registry to watch.
+    """
+    return preprocessing_path(booster_path), compiled_trees.library_path(booster_path)
+
+
+class _Stub:
+    # stands in for a pycaret class, keeping only its pickled attributes
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class _PipelineUnpickler(joblib.numpy_pickle.NumpyUnpickler):
+    stubs = {}
+
+    def find_class(self, module, name):
+        if module.split('.')[0] in ('pycaret', 'category_encoders'):
+            try:
+                return super().find_class(module, name)
+            except ImportError:
+                return self.stubs.setdefault((module, name), type(name, (_Stub,), {'__module__': module}))
+        if module == 'pandas.core.indexes.numeric':
+            # Int64Index and friends, removed in pandas 2
+            return pd.Index
+        return super().find_class(module, name)
+
+
+def read_pipeline(path=DEFAULT_PIPELINE_PATH):
+    """
+    The pickled PyCaret pipeline. Without pycaret installed its classes are
+    replaced by plain objects that carry their fitted attributes, which is
+    enough to read the steps but not to call them.
+    """
+    unpickler = joblib.numpy_pickle.NumpyUnpickler
+    joblib.numpy_pickle.NumpyUnpickler = _PipelineUnpickler
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return joblib.load(path)
+    finally:
+        joblib.numpy_pickle.NumpyUnpickler = unpickler
+
+
+def export(pipeline_path=DEFAULT_PIPELINE_PATH, booster_path=DEFAULT_BOOSTER_PATH, save_booster=False):
+    """
+    Writes the fitted preprocessing of the pipeline to preprocessing_path(booster_path),
+    and its Booster to booster_path if save_booster. Returns the preprocessing dict.
+    """
+    steps = dict(read_pipeline(pipeline_path).steps)
+    numeric = steps['numerical_imputer'].transformer
+    categorical = steps['categorical_imputer'].transformer
+    onehot = steps['onehot_encoding'].transformer
+    booster = steps['trained_model'].get_booster()
+
+    encoded = {}
+    for fill, item in zip(categorical.statistics_, onehot.ordinal_encoder.mapping):
+        mapping = item['mapping']
+        categories = [str(c) for c, code in mapping.items() if code > 0 and not pd.isna(c)]
+        encoded[item['col']] = {
+            'fill': str(fill),
+            'categories': categories,
+            'columns': [f"{item['col']}_{c}" for c in categories],
+        }
+    preprocessing = {
+        'source': os.path.basename(pipeline_path),
+        'numeric': {
+            'columns': [str(c) for c in numeric.feature_names_in_],
+            'fill': [float(v) for v in numeric.statistics_],
+        },
+        'categorical': encoded,
+        'features': list(booster.feature_names),
+        'threshold': 0.5,
+    }
+    if save_booster:
+        booster.save_model(booster_path)
+    with open(preprocessing_path(booster_path), 'w') as f:
+        json.dump(preprocessing, f, indent=2)
+    return preprocessing
+
+
+class PotabilityModel:
+    """
+    booster_path -> XGBoost Booster saved by export (or extract_model.py), with
+                    its preprocessing file alongside
+    nthread      -> threads per prediction (default is 1, best for single rows)
+    engine       -> 'booster' (XGBoost), 'compiled' (compiled_trees library) or
+                    'auto', compiled if its library is up to date
+
+        model = PotabilityModel()
+        model.predict(frame)        # 0 fit for use / 1 polluted, like the pipeline
+        model.predict_proba(rows)   # probability of class 1
+        model.predictor             # the Booster or CompiledTrees doing the work
+    """
+
+    def __init__(self, booster_path=DEFAULT_BOOSTER_PATH, nthread=1, engine=DEFAULT_ENGINE):
+        with open(preprocessing_path(booster_path)) as f:
+            self.preprocessing = json.load(f)
+        self.booster = xgb.Booster(model_file=booster_path)
+        self.booster.set_param({'nthread': nthread})
+        self.features = self.preprocessing['features']
+        self.threshold = self.preprocessing['threshold']
+        if self.booster.feature_names and list(self.booster.feature_names) != self.features:
+            raise ValueError(f"{booster_path} doesn't match its preprocessing file")
+
+        index = {name: i for i, name in enumerate(self.features)}
+        numeric = self.preprocessing['numeric']
+        self.numeric = numeric['columns']
+        self._numeric_index = np.array([index[c] for c in self.numeric])
+        self._numeric_fill = np.array(numeric['fill'], dtype=np.float32)
+        self.categorical = {}
+        for col, spec in self.preprocessing['categorical'].items():
+            self.categorical[col] = (spec['fill'], np.array(spec['categories'], dtype=object),
+                                     np.array([index[c] for c in spec['columns']]))
+        self.inputs = self.numeric + list(self.categorical)
+
+        if engine == 'auto':
+            engine = 'compiled' if compiled_trees.is_compiled(booster_path) else 'booster'
+        if engine not in ('booster', 'compiled'):
+            raise ValueError(f"unknown engine {engine!r}")
+        self.engine = engine
+        self.predictor = compiled_trees.CompiledTrees(booster_path, nthread) if engine == 'compiled' else self.booster
+        self._local = threading.local()
+
+    def _buffer(self, n):
+        # one growing array per thread, so concurrent sessions don't share it
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or len(buffer) < n:
+            buffer = self._local.buffer = np.empty((max(n, 1), len(self.features)), dtype=np.float32)
+        return buffer[:n]
+
+    def _columns(self, rows):
+        # {name: column} of a DataFrame or list of dicts; DataFrame.items is much
+        # cheaper than indexing the frame once per column
+        if isinstance(rows, pd.DataFrame):
+            return {col: series.to_numpy() for col, series in rows.items()}
+        return {col: [row.get(col) for row in rows] for col in self.inputs}
+
+    def transform(self, rows):
+        """
+        The model input of rows (a DataFrame, a dict or a list of dicts) as a
+        float32 (n, 19) array. The array is reused by the next call of the
+        same thread.
+        """
+        if isinstance(rows, dict):
+            rows = [rows]
+        n = len(rows)
+        out = self._buffer(n)
+        columns = self._columns(rows)
+        numeric = np.empty((n, len(self.numeric)), dtype=np.float32)
+        for j, col in enumerate(self.numeric):
+            numeric[:, j] = np.asarray(columns[col], dtype=np.float32) if col in columns else np.nan
+        out[:, self._numeric_index] = np.where(np.isnan(numeric), self._numeric_fill, numeric)
+
+        for col, (fill, categories, index) in self.categorical.items():
+            values = np.array(columns[col], dtype=object) if col in columns else np.full(n, None, dtype=object)
+            values[pd.isna(values)] = fill
+            out[:, index] = values[:, None] == categories[None, :]
+        return out
+
+    def predict_proba(self, rows):
+        """
+        Probability of class 1 (polluted) for each row.
+        """
+        return self.predictor.inplace_predict(self.transform(rows), missing=np.nan)
+
+    def predict(self, rows):
+        """
+        Class of each row, 0 fit for use / 1 polluted.
+        """
+        return (self.predict_proba(rows) > self.threshold).astype(np.int8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    ex = sub.add_parser('export', help='write the preprocessing file (and Booster) from the pipeline pickle')
+    ex.add_argument('--pipeline', default=DEFAULT_PIPELINE_PATH)
+    ex.add_argument('--booster', default=DEFAULT_BOOSTER_PATH)
+    ex.add_argument('--save-booster', action='store_true', help='overwrite the Booster file too')
+    co = sub.add_parser('compile', help='compile the Booster into a native library (needs a C compiler)')
+    co.add_argument('--booster', default=DEFAULT_BOOSTER_PATH)
+    co.add_argument('--cc', default=None, help='C compiler (default: $CC or cc)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        preprocessing = export(args.pipeline, args.booster, args.save_booster)
+        print(f"wrote {preprocessing_path(args.booster)} ({len(preprocessing['features'])} features)")
+    else:
+        print(f"wrote {compiled_trees.compile_booster(args.booster, args.cc)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Client of prediction_server.py for the Streamlit pages.
+
+When PREDICTION_SERVER_URL is set (e.g. http://127.0.0.1:8600), the pages
+send their predictions to the server, where requests of concurrent users
+are scored together. predict returns None when no server is configured or
+it can't be reached, and the page scores in-process as before.
+"""
+import math
+import os
+import threading
+
+import pandas as pd
+import requests
+
+SERVER_URL = os.environ.get('PREDICTION_SERVER_URL', '').rstrip('/')
+TIMEOUT = float(os.environ.get('PREDICTION_SERVER_TIMEOUT', 2.0))
+
+_local = threading.local()
+
+
+def _session():
+    # one per thread, Streamlit runs every session in its own thread
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _records(rows):
+    # JSON-ready rows: plain Python values, missing values as null
+    if isinstance(rows, pd.DataFrame):
+        rows = rows.to_dict('records')
+    elif isinstance(rows, dict):
+        rows = [rows]
+    records = []
+    for row in rows:
+        record = {}
+        for name, value in row.items():
+            value = value.item() if hasattr(value, 'item') else value
+            record[name] = None if isinstance(value, float) and math.isnan(value) else value
+        records.append(record)
+    return records
+
+
+def predict(model, rows, url=None):
+    """
+    Predictions of the server's model ('potability' or 'habitat') for rows
+    (a DataFrame, a dict or a list of dicts), one per row, or None to score
+    in-process instead.
+    """
+    url = (url or SERVER_URL).rstrip('/')
+    if not url:
+        return None
+    try:
+        response = _session().post(f'{url}/predict/{model}', json={'rows': _records(rows)}, timeout=TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"prediction server unavailable, scoring in-process: {e}")
+        return None
+    return response.json()['predictions']
+
+
+def stats(url=None):
+    """
+    The server's /stats, or None without a reachable server.
+    """
+    url = (url or SERVER_URL).rstrip('/')
+    if not url:
+        return None
+    try:
+        response = _session().get(f'{url}/stats', timeout=TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+    return response.json()
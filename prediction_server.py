@@ -0,0 +1,251 @@
+"""
+Local HTTP prediction service for the water potability model and the
+aquatic habitat rules.
+
+Both are held in memory. Each model has one batching thread: concurrent
+requests are queued, and the first queued request waits at most max-wait
+for others to join, up to max-batch rows, before the whole batch is scored
+in one vectorized call. The Streamlit pages use it through
+prediction_client.py when PREDICTION_SERVER_URL is set.
+
+Endpoints (JSON):
+    POST /predict/potability  {"rows": [{"pH": 7.1, "Color": "Colorless", ...}, ...]}
+                              -> {"predictions": [0, ...], "probabilities": [0.02, ...]}
+    POST /predict/habitat     {"rows": [{"pH": 7.1, ...}, ...]} -> {"predictions": [0, ...]}
+    GET  /stats               -> per model requests, batches, mean batch size and
+                                 latency percentiles (queued to scored, in ms)
+    GET  /health              -> {"ok": true}
+
+Rows use the column names of test_data/test_df; missing values are null.
+Errors are {"error": message}, with status 400 for a malformed request or
+row and 500 when scoring fails or times out.
+
+Usage:
+    python prediction_server.py
+    python prediction_server.py --port 8600 --max-batch 512 --max-wait-ms 5
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import potability_model as pm
+import rule_based_classifier as rbc
+from model_registry import registry
+
+DEFAULT_PORT = 8600
+
+
+class MicroBatcher:
+    """
+    predict_batch -> function of a list of rows returning one result per row
+    max_batch     -> rows per call, a larger request is scored on its own
+    max_wait      -> seconds the first queued request waits for others
+    window        -> requests kept for the latency percentiles
+
+        batcher = MicroBatcher(lambda rows: [sum(r) for r in rows])
+        batcher.submit([[1, 2], [3, 4]])   # [3, 7], scored with whatever else was queued
+    """
+
+    def __init__(self, predict_batch, max_batch=256, max_wait=0.002, window=10_000):
+        self.predict_batch = predict_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self._latencies = deque(maxlen=window)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, rows, timeout=30):
+        """
+        Results for rows, once their batch has been scored. Raises what
+        predict_batch raised.
+        """
+        future = Future()
+        self._queue.put((rows, future, time.perf_counter()))
+        return future.result(timeout)
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._run(batch, size)
+
+    def _run(self, batch, size):
+        try:
+            results = self.predict_batch([row for rows, _, _ in batch for row in rows])
+        except Exception as e:
+            if len(batch) > 1:
+                # score the requests one by one, so only the bad one fails
+                for item in batch:
+                    self._run([item], len(item[0]))
+            else:
+                batch[0][1].set_exception(e)
+            return
+        done = time.perf_counter()
+        offset = 0
+        for rows, future, _ in batch:
+            future.set_result(results[offset:offset + len(rows)])
+            offset += len(rows)
+        with self._lock:
+            self._latencies.extend(done - queued for _, _, queued in batch)
+            self.requests += len(batch)
+            self.batches += 1
+            self.rows += size
+
+    def stats(self):
+        # copied under the lock, the batching thread appends to the deque
+        with self._lock:
+            latencies = list(self._latencies)
+            requests, batches, rows = self.requests, self.batches, self.rows
+        latencies = np.array(latencies) * 1000
+        stats = {
+            'requests': requests,
+            'batches': batches,
+            'mean_batch_size': rows / batches if batches else 0.0,
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+        if len(latencies):
+            stats.update({f'p{q}_ms': float(np.percentile(latencies, q)) for q in (50, 90, 99)})
+            stats['max_ms'] = float(latencies.max())
+        return stats
+
+
+def predict_potability(rows, booster_path=pm.DEFAULT_BOOSTER_PATH):
+    # through the registry, so replacing the model files reloads it
+    model = registry.get(booster_path, loader=pm.PotabilityModel, companions=pm.companion_paths(booster_path))
+    proba = model.predict_proba(rows)
+    return [{'prediction': int(p > model.threshold), 'probability': float(p)} for p in proba]
+
+
+def predict_habitat(rows):
+    return [{'prediction': rbc.is_habitable(*[row[name] for name in rbc.features])} for row in rows]
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """
+    address   -> (host, port) to listen on
+    max_batch -> rows per model call
+    max_wait  -> seconds a request waits for others to share its batch
+
+        server = PredictionServer(('127.0.0.1', 8600))
+        server.serve_forever()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, max_batch=256, max_wait=0.002, verbose=False):
+        super().__init__(address, Handler)
+        self.verbose = verbose
+        self.batchers = {
+            'potability': MicroBatcher(predict_potability, max_batch, max_wait),
+            'habitat': MicroBatcher(predict_habitat, max_batch, max_wait),
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    # keep-alive, clients reuse one connection for many predictions
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without this each response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, {'ok': True})
+        elif self.path == '/stats':
+            self._send(200, {name: batcher.stats() for name, batcher in self.server.batchers.items()})
+        else:
+            self._send(404, {'error': f'no such endpoint {self.path}'})
+
+    def do_POST(self):
+        # read the body even when it's unused, the connection carries the next request
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        name = self.path.removeprefix('/predict/')
+        batcher = self.server.batchers.get(name) if self.path.startswith('/predict/') else None
+        if batcher is None:
+            self._send(404, {'error': f'no such endpoint {self.path}'})
+            return
+        try:
+            body = json.loads(data)
+            rows = body['rows'] if isinstance(body, dict) and 'rows' in body else body
+            if isinstance(rows, dict):
+                rows = [rows]
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise ValueError('expected {"rows": [{column: value, ...}, ...]}')
+        except (ValueError, KeyError) as e:
+            self._send(400, {'error': str(e)})
+            return
+        if not rows:
+            self._send(200, {'predictions': []})
+            return
+        try:
+            results = batcher.submit(rows)
+        except (KeyError, TypeError, ValueError) as e:
+            # a row missing a column or with a value of the wrong type
+            self._send(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+        except Exception as e:
+            # scoring failed or timed out (TimeoutError has no message), answer rather than drop the connection
+            self._send(500, {'error': f'{type(e).__name__}: {e}' if str(e) else type(e).__name__})
+            return
+        response = {'predictions': [r['prediction'] for r in results]}
+        if 'probability' in results[0]:
+            response['probabilities'] = [r['probability'] for r in results]
+        self._send(200, response)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch', type=int, default=256, help='rows per model call')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='how long a request waits for others')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    server = PredictionServer((args.host, args.port), args.max_batch, args.max_wait_ms / 1000, args.verbose)
+    # load the models now rather than on the first request
+    predict_potability([{}])
+    predict_habitat([dict.fromkeys(rbc.features, 0.0)])
+    print(f"Serving predictions on http://{args.host}:{args.port} "
+          f"(max batch {args.max_batch}, max wait {args.max_wait_ms}ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Resolution-adaptive preprocessing for the dehaze -> detect flow.
+
+Images keep their own resolution and aspect ratio instead of being squashed
+to 416x416:
+
+    dehazing  -> the guided filter, which dominates the cost, computes its
+                 coefficients at a working resolution (longest side about
+                 DEHAZE_SIZE) and applies them with the full resolution image
+                 as the guide (the fast guided filter of dark_channel_prior)
+    detection -> the detector letterboxes to INFERENCE_SIZE (never above the
+                 image itself, rounded up to the model stride) and maps the
+                 boxes back to the original image coordinates
+
+A larger INFERENCE_SIZE finds smaller debris at a higher cost, a smaller one
+is faster; DEHAZE_SIZE trades dehazing time for transmission map detail.
+Both can be set per deployment through the environment.
+"""
+import os
+
+import numpy as np
+
+import dark_channel_prior as dcp
+
+INFERENCE_SIZE = int(os.environ.get('INFERENCE_SIZE', 640))
+DEHAZE_SIZE = int(os.environ.get('DEHAZE_SIZE', 416))
+
+# dehazing parameters of app.remove_noise
+DEHAZE_PARAMS = {'w_size': 15, 'a_omega': 0.95, 'gf_w_size': 200, 'eps': 1e-6}
+
+
+def fit_size(shape, max_side):
+    """
+    (width, height) of an image of the given shape scaled down so its longest
+    side is at most max_side, keeping the aspect ratio. Never scales up;
+    max_side 0 keeps the original size.
+    """
+    h, w = shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return w, h
+    scale = max_side / max(h, w)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def inference_size(shape, imgsz=INFERENCE_SIZE, stride=32):
+    """
+    Letterbox size for detecting on an image of the given shape: imgsz, or
+    the image's longest side rounded up to the stride if that is smaller, so
+    small images aren't upscaled.
+    """
+    longest = -(-max(shape[:2]) // stride) * stride
+    return max(stride, min(imgsz, longest))
+
+
+def dehaze_params(shape, working_size=DEHAZE_SIZE, **dehaze_kwargs):
+    """
+    haze_removal / DehazeContext parameters for images of the given shape.
+
+    working_size  -> longest side the guided filter coefficients are computed at (rounded to an
+                     integer subsampling ratio), 0 for full resolution
+    dehaze_kwargs -> haze_removal parameters (default DEHAZE_PARAMS), a larger gf_subsample wins
+
+    ret -> dehaze_kwargs with gf_subsample set, and low_memory unless given
+    """
+    dehaze_kwargs = dehaze_kwargs or DEHAZE_PARAMS
+    # the guided filter's a and b are computed at the working resolution and
+    # combined with the full resolution image (guided_filter's subsample path);
+    # the dark channel, A and the raw transmission stay at full resolution, in
+    # the float32 low_memory pipeline, which matches the default to 1 level
+    ratio = max(shape[:2]) // working_size if working_size else 1
+    dehaze_kwargs = dict(dehaze_kwargs, gf_subsample=max(ratio, dehaze_kwargs.get('gf_subsample', 1), 1))
+    dehaze_kwargs.setdefault('low_memory', True)
+    return dehaze_kwargs
+
+
+def dehaze(image, working_size=DEHAZE_SIZE, haze_threshold=None, **dehaze_kwargs):
+    """
+    Dehazes an RGB image at a working resolution and returns it at its own.
+
+    working_size   -> see dehaze_params
+    haze_threshold -> skip dehazing below this dark_channel_prior.haze_score (default None, always dehaze)
+    dehaze_kwargs  -> haze_removal parameters (default DEHAZE_PARAMS)
+
+    ret -> (uint8 image of the input's size, whether it was dehazed, haze score or None)
+    """
+    score = None
+    if haze_threshold is not None:
+        score = dcp.haze_score(image)[0]
+        if score < haze_threshold:
+            return image, False, score
+
+    dehazed, _ = dcp.haze_removal(image, **dehaze_params(image.shape, working_size, **dehaze_kwargs))
+    return np.clip(dehazed, 0, 255).astype(np.uint8), True, score
+
+
+def detect(image, imgsz=INFERENCE_SIZE, **model):
+    """
+    inference.detect at the adaptive inference size; the plotted image and
+    boxes are in the coordinates of image. model selects the cached
+    detector (model_path, device, backend).
+    """
+    import inference as inf
+
+    return inf.detect(image, imgsz=inference_size(image.shape, imgsz), **model)
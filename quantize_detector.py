@@ -0,0 +1,121 @@
+"""
+Builds the INT8 version of the underwater waste detector for the
+'onnx-int8' backend of inference.py.
+
+The .pt weights are exported to ONNX (inference.export_onnx) and quantized
+with ONNX Runtime. Static quantization (the default) calibrates activation
+ranges on images that went through the same preprocessing as the app
+(preprocessing.dehaze and letterboxing), so the ranges match what the model
+sees in production. Dynamic quantization needs no images but only
+quantizes the weights and is usually slower for a convolutional network.
+
+The Detect head's box decoding and class scoring stay in float, since
+quantizing them costs far more accuracy than time.
+
+Usage:
+    python quantize_detector.py path/to/calibration/images/ --num-images 200
+    python quantize_detector.py --mode dynamic
+    python evaluate_quantized.py --data path/to/data.yaml   # mAP change and speedup
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+import cv2
+
+import inference as inf
+import preprocessing as pre
+from batch_dehaze import collect_images
+
+
+def calibration_images(inputs, num_images, dehaze=True):
+    """
+    Yields RGB calibration images dehazed the way app.app() does.
+    """
+    for path, _ in collect_images(inputs)[:num_images]:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if dehaze:
+            image = pre.dehaze(image)[0]
+        yield image
+
+
+def head_nodes(model):
+    """
+    Names of the YOLOv8 Detect head nodes outside its convolution branches
+    (box distribution decoding, anchors, sigmoid and the final concatenation).
+    """
+    layers = [re.match(r'/model\.(\d+)/', node.name) for node in model.graph.node]
+    prefix = f"/model.{max(int(m.group(1)) for m in layers if m)}/"
+    # the cv2 / cv3 convolution branches of the head are quantized like the rest
+    return [node.name for node in model.graph.node
+            if node.name.startswith(prefix) and not node.name.startswith((prefix + 'cv2.', prefix + 'cv3.'))]
+
+
+def quantize(model_path=None, inputs=(), num_images=100, mode='static', dehaze=True, per_channel=True,
+             calibrate_method='minmax', output=None):
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                          quant_pre_process, quantize_dynamic, quantize_static)
+
+    fp32_path = inf.export_onnx(model_path)
+    output = output or inf.quantized_model_path(model_path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepared = os.path.join(tmp, 'prepared.onnx')
+        quant_pre_process(fp32_path, prepared, skip_symbolic_shape=True)
+        exclude = head_nodes(onnx.load(prepared))
+
+        if mode == 'dynamic':
+            quantize_dynamic(prepared, output, weight_type=QuantType.QInt8, per_channel=per_channel,
+                             nodes_to_exclude=exclude)
+            return output
+
+        fp32 = inf.OnnxRuntimeModel(fp32_path)
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self.images = calibration_images(inputs, num_images, dehaze=dehaze)
+
+            def get_next(self):
+                image = next(self.images, None)
+                if image is None:
+                    return None
+                return {fp32.input_name: fp32.preprocess([image])}
+
+        method = {'minmax': CalibrationMethod.MinMax, 'entropy': CalibrationMethod.Entropy,
+                  'percentile': CalibrationMethod.Percentile}[calibrate_method]
+        quantize_static(prepared, output, Reader(), quant_format=QuantFormat.QDQ, per_channel=per_channel,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        calibrate_method=method, nodes_to_exclude=exclude)
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='*', help='calibration image directories or glob patterns')
+    parser.add_argument('--model', default=inf.DEFAULT_MODEL_PATH, help='.pt weights (default: waste detector)')
+    parser.add_argument('--mode', choices=['static', 'dynamic'], default='static')
+    parser.add_argument('--num-images', type=int, default=100, help='calibration images to use')
+    parser.add_argument('--calibrate-method', choices=['minmax', 'entropy', 'percentile'], default='minmax')
+    parser.add_argument('--no-dehaze', action='store_true', help='calibrate on raw instead of dehazed images')
+    parser.add_argument('--per-tensor', action='store_true', help='one weight scale per tensor, not per channel')
+    parser.add_argument('-o', '--output', default=None, help='default: <weights>.int8.onnx')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'static' and not args.inputs:
+        parser.error("static quantization needs calibration images")
+
+    output = quantize(args.model, args.inputs, num_images=args.num_images, mode=args.mode,
+                      dehaze=not args.no_dehaze, per_channel=not args.per_tensor,
+                      calibrate_method=args.calibrate_method, output=args.output)
+    print(f"Saved {args.mode} INT8 model to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Content-addressed cache of dehaze + detection results.
+
+Results are keyed by a hash of the uploaded image bytes and every parameter
+that changes the output (dehazing parameters, haze gate threshold, model
+version), so a re-uploaded file or a Streamlit rerun is served from memory
+instead of being dehazed and detected again. Entries live in an LRU bounded
+by count and by the bytes of their arrays in memory and, optionally, in a
+directory on disk that survives restarts.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def cache_key(data, **params):
+    """
+    Hex digest identifying data (bytes) processed with params (JSON
+    serializable values, e.g. w_size=15, model='...').
+    """
+    digest = hashlib.blake2b(data, digest_size=20)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def value_nbytes(value):
+    """
+    Bytes held by the arrays (anything with an nbytes) in value, looking into
+    dicts, lists and tuples. Other objects count as 0.
+    """
+    if isinstance(value, dict):
+        return sum(value_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(value_nbytes(v) for v in value)
+    return getattr(value, 'nbytes', 0)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with an optional on-disk tier.
+
+    max_items -> entries kept in memory, the least recently used is dropped first
+    disk_dir  -> directory for pickled entries (default None, memory only);
+                 a memory miss that is found on disk is promoted back to memory
+    max_bytes -> limit on the value_nbytes of the entries in memory (default None,
+                 count only); an entry larger than this is only kept on disk
+
+    Only point disk_dir at a directory this app alone writes to, entries are
+    unpickled when read.
+    """
+
+    def __init__(self, max_items=64, disk_dir=None, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + '.pkl')
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.disk_dir:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.disk_dir:
+            # write to a temporary file first so readers never see a partial entry
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, self._path(key))
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def _remember(self, key, value):
+        size = value_nbytes(value)
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                # would evict every other entry and then itself, keep it on disk only
+                if key in self._entries:
+                    del self._entries[key]
+                    self.nbytes -= self._sizes.pop(key)
+                return
+            self.nbytes += size - self._sizes.get(key, 0)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+            while self._entries and (len(self._entries) > self.max_items or
+                                     (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                old, _ = self._entries.popitem(last=False)
+                self.nbytes -= self._sizes.pop(old)
+
+    def clear(self, disk=False):
+        """
+        Drops the in-memory entries, and the on-disk ones too if disk is True.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+        if disk and self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.disk_dir, name))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'items': len(self._entries), 'bytes': self.nbytes}
+
+    def __len__(self):
+        return len(self._entries)
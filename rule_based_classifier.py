@@ -2,6 +2,9 @@ import streamlit as st
 import pandas as pd
 import os
 from llm_advisor import get_ai_advice
+from detection_stats import current_session
+from event_log import get_event_log
+import prediction_client
 
 # Get the directory of the current script
 base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -161,8 +164,12 @@ def rbc():
     # Prediction logic
     if predict_btn:
         inputs_list = list(inputs.values())
-        is_good = is_habitable(*inputs_list)
+        # On the prediction server if one is configured, else in-process
+        remote = prediction_client.predict('habitat', dict(zip(features, inputs_list)))
+        is_good = remote[0] if remote is not None else is_habitable(*inputs_list)
         quality_aquatic.append(is_good)
+        get_event_log().record('aquatic', [is_good], params=dict(zip(features, inputs_list)),
+                               session=current_session())
         
         st.markdown("---")
         st.markdown("### 📊 Assessment Result")
@@ -290,8 +297,12 @@ def rbc():
             data_display['Total Dissolved Solids'].values[0]
         ]
         
-        is_good = is_habitable(*inputs_list)
+        # On the prediction server if one is configured, else in-process
+        remote = prediction_client.predict('habitat', dict(zip(features, inputs_list)))
+        is_good = remote[0] if remote is not None else is_habitable(*inputs_list)
         quality_aquatic.append(is_good)
+        get_event_log().record('aquatic', [is_good], params=dict(zip(features, inputs_list)),
+                               session=current_session())
         
         st.markdown("### 📊 Assessment Result")
         
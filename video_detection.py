@@ -0,0 +1,261 @@
+"""
+Waste detection on dive videos.
+
+Frames are decoded as a stream (dark_channel_prior.video_frames). Every Nth
+frame is dehazed with a StreamDehazer (the parameters of app.remove_noise,
+with the atmospheric light reused across frames and the guided filter at the
+preprocessing.DEHAZE_SIZE working resolution) and run through the cached
+detector. An IoU tracker links the detections over time and moves the boxes
+along in the frames in between, so each piece of debris is counted once for
+the whole video instead of once per frame.
+
+Usage:
+    python video_detection.py dive.mp4
+    python video_detection.py dive.mp4 --every 10 -o annotated.mp4 --backend onnx
+    python video_detection.py dive.mp4 --no-dehaze --imgsz 960 --max-frames 3000
+    python video_detection.py dive.mp4 --dehaze-size 0 --no-low-memory
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+
+import cv2 as cv
+import numpy as np
+
+import dark_channel_prior as dcp
+import inference as inf
+import preprocessing as pre
+
+
+class Track:
+    def __init__(self, track_id, box, confidence, class_id):
+        self.id = track_id
+        self.box = box
+        self.confidence = confidence
+        self.class_id = class_id
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.detected_box = box
+        self.frames_since_detection = 0
+        self.hits = 1
+        self.misses = 0
+
+
+class IoUTracker:
+    """
+    Greedy IoU tracker with constant velocity motion between detections.
+
+    iou_threshold -> IoU a detection needs with a track's predicted box to continue it (default is 0.3)
+    max_misses    -> detection rounds a track survives without a match (default is 2)
+    min_hits      -> matches before a track counts as a real item (default is 2); filters one-off false positives
+
+        tracker = IoUTracker()
+        tracker.predict()                             # on every frame
+        tracker.update(boxes, confidences, class_ids)  # then on frames the detector ran on
+        tracker.counts()                              # unique items per class name
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=2, min_hits=2):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+        self.tracks = []
+        self.counted = Counter()
+        self._counted_ids = set()
+        self._next_id = 1
+
+    def predict(self):
+        """
+        Moves every track one frame along its velocity and returns the tracks.
+        """
+        for track in self.tracks:
+            track.box = track.box + track.velocity
+            track.frames_since_detection += 1
+        return self.tracks
+
+    def update(self, boxes, confidences, class_ids):
+        """
+        Matches one frame's detections to the tracks (same class, highest IoU
+        first), starts tracks for the unmatched ones and drops tracks missed
+        more than max_misses times. Returns the tracks.
+
+        Call predict for the frame first: the detections are matched against
+        the moved boxes, and the velocity is the displacement since the last
+        detection over the frames predict counted.
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        matched_tracks, matched_detections = set(), set()
+        if self.tracks and len(boxes):
+            iou = inf._overlap_matrix(np.array([t.box for t in self.tracks]), boxes, metric='iou')
+            iou[np.array([t.class_id for t in self.tracks])[:, None] != np.asarray(class_ids)[None, :]] = 0
+            for flat in np.argsort(-iou, axis=None):
+                i, j = np.unravel_index(flat, iou.shape)
+                if iou[i, j] < self.iou_threshold:
+                    break
+                if i in matched_tracks or j in matched_detections:
+                    continue
+                matched_tracks.add(i)
+                matched_detections.add(j)
+                track = self.tracks[i]
+                frames = max(track.frames_since_detection, 1)
+                track.velocity = 0.5 * track.velocity + 0.5 * (boxes[j] - track.detected_box) / frames
+                track.box = track.detected_box = boxes[j]
+                track.confidence = float(confidences[j])
+                track.frames_since_detection = 0
+                track.hits += 1
+                track.misses = 0
+
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        for j in range(len(boxes)):
+            if j not in matched_detections:
+                self.tracks.append(Track(self._next_id, boxes[j], float(confidences[j]), int(class_ids[j])))
+                self._next_id += 1
+
+        for track in self.tracks:
+            if track.hits >= self.min_hits and track.id not in self._counted_ids:
+                self._counted_ids.add(track.id)
+                self.counted[inf.labels[track.class_id]] += 1
+        return self.tracks
+
+    def counts(self):
+        """
+        Unique items seen so far, per class name.
+        """
+        return Counter(self.counted)
+
+
+def draw_tracks(frame, tracks, min_hits=1):
+    """
+    Returns a copy of frame with the boxes and ids of the tracks drawn on it.
+    """
+    frame = frame.copy()
+    for track in tracks:
+        if track.hits < min_hits:
+            continue
+        x1, y1, x2, y2 = (int(v) for v in track.box)
+        color = tuple(int(c) for c in np.random.default_rng(track.id).integers(64, 256, 3))
+        cv.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv.putText(frame, f"{inf.labels[track.class_id]} #{track.id}", (x1, max(y1 - 5, 10)),
+                   cv.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv.LINE_AA)
+    return frame
+
+
+def detect_video(source, detect_every=5, dehaze=True, imgsz=pre.INFERENCE_SIZE, output=None, max_frames=None,
+                 tracker=None, progress=None, model_path=None, device=None, backend=None,
+                 dehaze_size=pre.DEHAZE_SIZE, gf_subsample=1, low_memory=True, **predict_kwargs):
+    """
+    Runs the waste detector over a video file (or camera index).
+
+    detect_every -> run the detector on every Nth frame, track in between (default is 5)
+    dehaze       -> dehaze the detected frames with a StreamDehazer (default True)
+    imgsz        -> detector letterbox size, see preprocessing.inference_size
+    output       -> path of an annotated video to write (default None)
+    max_frames   -> stop after this many frames
+    tracker      -> IoUTracker to use (default IoUTracker())
+    progress     -> called as progress(frames done) after every frame
+    dehaze_size  -> guided filter working resolution, see preprocessing.dehaze_params
+    gf_subsample -> minimum guided filter subsampling ratio (default 1)
+    low_memory   -> float32 dehazing pipeline (default True)
+
+    ret -> dict with
+        counts          -> Counter of unique items per class name
+        frames          -> frames processed
+        detected_frames -> frames the detector ran on
+        elapsed         -> seconds
+        fps             -> effective frames per second over the whole video
+        source_fps      -> frame rate of the video, 0 if unknown
+    """
+    tracker = tracker or IoUTracker()
+    dehazer = None
+    predict_kwargs.setdefault('verbose', False)
+
+    capture = cv.VideoCapture(source)
+    source_fps = capture.get(cv.CAP_PROP_FPS) or 0
+    capture.release()
+
+    writer = None
+    frames = detected = 0
+    start = time.perf_counter()
+    try:
+        for frame in dcp.video_frames(source):
+            if max_frames is not None and frames >= max_frames:
+                break
+            # every frame moves the tracks, detected ones then correct them
+            tracks = tracker.predict()
+            if frames % detect_every == 0:
+                if dehaze and dehazer is None:
+                    # the subsampling ratio depends on the frame size, known from the first frame
+                    params = dict(pre.DEHAZE_PARAMS, gf_subsample=gf_subsample, low_memory=low_memory)
+                    dehazer = dcp.StreamDehazer(**pre.dehaze_params(frame.shape, dehaze_size, **params))
+                image = np.clip(dehazer.dehaze(frame), 0, 255).astype(np.uint8) if dehazer else frame
+                result = inf.detect_batch([image], imgsz=pre.inference_size(image.shape, imgsz),
+                                          model_path=model_path, device=device, backend=backend,
+                                          **predict_kwargs)[0]
+                tracks = tracker.update(result['boxes'], result['confidences'], result['class_ids'])
+                detected += 1
+
+            if output:
+                if writer is None:
+                    h, w = frame.shape[:2]
+                    writer = cv.VideoWriter(output, cv.VideoWriter_fourcc(*'mp4v'), source_fps or 25, (w, h))
+                annotated = draw_tracks(frame, tracks, tracker.min_hits)
+                writer.write(cv.cvtColor(annotated, cv.COLOR_RGB2BGR))
+            frames += 1
+            if progress is not None:
+                progress(frames)
+    finally:
+        if writer is not None:
+            writer.release()
+
+    elapsed = time.perf_counter() - start
+    return {
+        'counts': tracker.counts(),
+        'frames': frames,
+        'detected_frames': detected,
+        'elapsed': elapsed,
+        'fps': frames / elapsed if elapsed else 0.0,
+        'source_fps': source_fps,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='video file, or camera index')
+    parser.add_argument('-o', '--output', default=None, help='write the annotated video here (.mp4)')
+    parser.add_argument('--every', type=int, default=5, help='run the detector on every Nth frame')
+    parser.add_argument('--no-dehaze', action='store_true')
+    parser.add_argument('--imgsz', type=int, default=pre.INFERENCE_SIZE)
+    parser.add_argument('--dehaze-size', type=int, default=pre.DEHAZE_SIZE,
+                        help='dehazing working resolution (longest side), 0 for full resolution')
+    parser.add_argument('--gf-subsample', type=int, default=1)
+    parser.add_argument('--no-low-memory', action='store_true', help='dehaze in float64')
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--iou', type=float, default=0.3, help='IoU to continue a track')
+    parser.add_argument('--max-misses', type=int, default=2, help='detection rounds a track survives unmatched')
+    parser.add_argument('--min-hits', type=int, default=2, help='detections before an item is counted')
+    parser.add_argument('--model', default=None, help='.pt weights (default: waste detector)')
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--backend', default=None, choices=inf.BACKENDS)
+    args = parser.parse_args(argv)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    inf.warm_up(args.model, args.device, backend=args.backend)
+    summary = detect_video(source, args.every, not args.no_dehaze, args.imgsz, args.output, args.max_frames,
+                           IoUTracker(args.iou, args.max_misses, args.min_hits), model_path=args.model,
+                           device=args.device, backend=args.backend, dehaze_size=args.dehaze_size,
+                           gf_subsample=args.gf_subsample, low_memory=not args.no_low_memory)
+
+    print(f"{summary['frames']} frame(s), detector ran on {summary['detected_frames']}, in {summary['elapsed']:.1f}s")
+    realtime = f" ({summary['fps'] / summary['source_fps']:.2f}x real time)" if summary['source_fps'] else ""
+    print(f"effective speed: {summary['fps']:.1f} FPS{realtime}")
+    print(f"unique items: {sum(summary['counts'].values())}")
+    for name, count in summary['counts'].most_common():
+        print(f"  {name}: {count}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())